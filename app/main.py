@@ -4,11 +4,29 @@ FastAPI application for Member QnA Service.
 This module provides REST API endpoints for the question-answering system.
 """
 
+import os
+import sys
+import gc
+import json
+import time
+import asyncio
 import logging
-from fastapi import FastAPI, HTTPException
+import psutil
+import tracemalloc
+from typing import List, AsyncIterator
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+from fastapi import FastAPI, HTTPException, Depends
+from fastapi.responses import StreamingResponse, PlainTextResponse
+
+try:
+    import resource  # Unix only; supplies the peak RSS gauge
+except ImportError:
+    resource = None
 
 from app.schemas import (
     QuestionRequest,
+    BatchQuestionRequest,
     AnswerResponse,
     HealthResponse,
     CacheClearResponse,
@@ -27,8 +45,106 @@ app = FastAPI(
     redoc_url="/redoc",
 )
 
-# Initialize the QnA agent (singleton)
-agent = QnAAgent()
+
+@lru_cache(maxsize=1)
+def get_agent() -> QnAAgent:
+    """
+    Return the QnA agent, constructing it on first use.
+    
+    The agent is created lazily once per worker process (by the startup
+    warmup hook or the first request) rather than at import time, so
+    importing the module stays cheap and tests can reset it with
+    get_agent.cache_clear().
+    
+    Returns:
+        The process-wide QnAAgent instance
+    """
+    return QnAAgent()
+
+
+# Pre-bound references for the /ask hot path. The agent is created lazily,
+# so its bound method is resolved once per request inside the endpoint.
+_now = time.perf_counter
+_log_info = logger.info
+_log_error = logger.error
+_get_running_loop = asyncio.get_running_loop
+
+# Threadpool size for blocking agent calls (FAISS search + OpenAI round-trips)
+EXECUTOR_MAX_WORKERS = int(os.getenv("EXECUTOR_MAX_WORKERS", "32"))
+
+# Load the FAISS index at startup instead of on the first request
+WARMUP_ON_STARTUP = os.getenv("WARMUP_ON_STARTUP", "1") == "1"
+
+# Max questions answered (i.e. OpenAI calls) at once per worker. Bursts queue
+# here instead of triggering 429s and LangChain retries that inflate tail latency.
+OPENAI_MAX_INFLIGHT = int(os.getenv("OPENAI_MAX_INFLIGHT", "8"))
+openai_sem = asyncio.Semaphore(OPENAI_MAX_INFLIGHT)
+
+
+# This worker process, for /metrics and /metrics/memory
+_process = psutil.Process(os.getpid())
+
+# getrusage() peak RSS unit: kilobytes on Linux, bytes on macOS
+_MAXRSS_SCALE = 1 if sys.platform == "darwin" else 1024
+
+# Trace Python allocations with this many frames per traceback, reported by
+# /metrics/heap (0 = off; tracing slows allocation-heavy code)
+TRACEMALLOC_FRAMES = int(os.getenv("TRACEMALLOC_FRAMES", "0"))
+if TRACEMALLOC_FRAMES > 0:
+    tracemalloc.start(TRACEMALLOC_FRAMES)
+_heap_baseline = None
+
+
+def get_openai_semaphore() -> asyncio.Semaphore:
+    """Dependency returning the shared semaphore that caps concurrent OpenAI calls."""
+    return openai_sem
+
+
+@app.on_event("startup")
+async def configure_executor():
+    """
+    Size the default executor used to run blocking agent calls.
+    
+    Agent calls are I/O-bound (OpenAI round-trips), so a larger pool lets
+    concurrent requests overlap instead of queueing behind each other.
+    """
+    loop = asyncio.get_running_loop()
+    loop.set_default_executor(ThreadPoolExecutor(max_workers=EXECUTOR_MAX_WORKERS))
+    logger.info("Default executor configured with %s workers", EXECUTOR_MAX_WORKERS)
+
+
+@app.on_event("startup")
+async def warmup_on_startup():
+    """
+    Load the FAISS index before the server starts accepting traffic.
+    
+    Removes the cold-start latency from the first user request after a
+    deploy. Disable with WARMUP_ON_STARTUP=0. A failed warmup is logged
+    and the index is loaded lazily on the first request instead.
+    
+    The agent itself is always constructed here, so each worker pays
+    that cost once before accepting traffic.
+    
+    Afterwards, everything allocated so far is frozen with gc.freeze().
+    """
+    loop = asyncio.get_running_loop()
+    agent = await loop.run_in_executor(None, get_agent)
+    
+    if not WARMUP_ON_STARTUP:
+        logger.info("Startup warmup disabled (WARMUP_ON_STARTUP=0)")
+    else:
+        try:
+            logger.info("Warming up agent on startup (loading FAISS index)...")
+            await loop.run_in_executor(None, agent.warmup)
+            logger.info("Startup warmup completed successfully")
+        except Exception as e:
+            logger.warning("Startup warmup failed, index will load on first request: %s", e)
+    
+    # Move long-lived startup objects (agent, index, compiled graph) into the
+    # permanent generation so later collections don't rescan them
+    gc.collect()
+    gc.freeze()
+    logger.info("Froze %s startup objects out of GC scans", gc.get_freeze_count())
 
 
 @app.get("/")
@@ -45,16 +161,21 @@ async def root():
         "description": "LangGraph-based question-answering system for member data",
         "endpoints": {
             "/ask": "POST - Ask a question about member data",
+            "/ask-batch": "POST - Ask several questions in one call (answered concurrently)",
+            "/ask-stream": "POST - Ask a question and stream the answer as server-sent events",
             "/health": "GET - Health check",
-            "/warmup": "POST - Pre-load FAISS index (reduces first request latency)",
+            "/metrics": "GET - Prometheus metrics (OpenAI concurrency cap usage, worker memory)",
+            "/metrics/memory": "GET - Memory of the worker process serving the request",
+            "/metrics/heap": "GET - Top Python allocation growth since the last call (needs TRACEMALLOC_FRAMES)",
+            "/warmup": "POST - Run a full warmup question (index is also pre-loaded at startup)",
             "/clear-cache": "POST - Clear member data cache",
             "/docs": "GET - Interactive API documentation (Swagger)",
             "/redoc": "GET - Alternative API documentation (ReDoc)",
         },
         "performance": {
             "typical_latency": "1-3 seconds per request",
-            "first_request": "2-4 seconds (loads FAISS index)",
-            "tip": "Call /warmup after deployment to pre-load the index"
+            "first_request": "1-3 seconds (FAISS index is pre-loaded at startup)",
+            "tip": "Set WARMUP_ON_STARTUP=0 to skip index pre-loading at startup"
         }
     }
 
@@ -70,6 +191,119 @@ async def health_check():
     return HealthResponse(status="healthy")
 
 
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """
+    Prometheus-style metrics for the OpenAI concurrency cap and memory.
+    
+    Use these to tune OPENAI_MAX_INFLIGHT per deployment: if in-flight
+    calls sit at the limit while latency climbs, requests are queueing.
+    The api_worker_*_bytes gauges track memory against the deployment's
+    budget. Values are per worker process.
+    
+    Returns:
+        Plain-text metrics in the Prometheus exposition format
+    """
+    available = openai_sem._value
+    text = (
+        "# HELP openai_max_inflight Maximum concurrent OpenAI calls per worker.\n"
+        "# TYPE openai_max_inflight gauge\n"
+        f"openai_max_inflight {OPENAI_MAX_INFLIGHT}\n"
+        "# HELP openai_semaphore_available Free OpenAI call slots.\n"
+        "# TYPE openai_semaphore_available gauge\n"
+        f"openai_semaphore_available {available}\n"
+        "# HELP openai_inflight OpenAI calls currently in flight.\n"
+        "# TYPE openai_inflight gauge\n"
+        f"openai_inflight {OPENAI_MAX_INFLIGHT - available}\n"
+    )
+    
+    # Memory gauges labelled by worker pid, so a scraper can tell the
+    # workers of a multi-worker deployment apart
+    label = f'{{pid="{_process.pid}"}}'
+    # memory_full_info() walks /proc/<pid>/smaps (slow for a large heap), so
+    # run it off the event loop
+    mem = await _get_running_loop().run_in_executor(None, _process.memory_full_info)
+    text += (
+        "# HELP api_worker_rss_bytes Resident set size of this worker.\n"
+        "# TYPE api_worker_rss_bytes gauge\n"
+        f"api_worker_rss_bytes{label} {mem.rss}\n"
+    )
+    if hasattr(mem, "uss"):
+        text += (
+            "# HELP api_worker_uss_bytes Memory only this worker uses (freed if it exits).\n"
+            "# TYPE api_worker_uss_bytes gauge\n"
+            f"api_worker_uss_bytes{label} {mem.uss}\n"
+        )
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * _MAXRSS_SCALE
+        text += (
+            "# HELP api_worker_peak_rss_bytes Highest resident set size of this worker so far.\n"
+            "# TYPE api_worker_peak_rss_bytes gauge\n"
+            f"api_worker_peak_rss_bytes{label} {peak}\n"
+        )
+    return text
+
+
+@app.get("/metrics/memory")
+async def memory_metrics(collect: bool = False):
+    """
+    Memory usage of the worker process serving this request.
+    
+    Lets memory tests sample the server when they can't inspect its
+    process directly (e.g. another user or container).
+    
+    Args:
+        collect: Run a full gc.collect() first, so garbage still waiting
+            for a collection doesn't count towards the figures
+    
+    Returns:
+        psutil memory_full_info() fields (rss, uss, pss, ...) in bytes
+    """
+    if collect:
+        gc.collect()
+    mem = await _get_running_loop().run_in_executor(None, _process.memory_full_info)
+    return mem._asdict()
+
+
+@app.get("/metrics/heap")
+async def heap_metrics(top: int = 10):
+    """
+    Python heap growth by source line since the previous call.
+    
+    RSS/USS show that memory grew; tracemalloc shows where. The first
+    call reports current allocations and sets the baseline; each later
+    call reports the diff against the previous snapshot. Baselines are
+    per worker process.
+    
+    Args:
+        top: Number of source lines to report
+        
+    Returns:
+        Traced heap size and the top allocation stats as strings
+    """
+    global _heap_baseline
+    if not tracemalloc.is_tracing():
+        raise HTTPException(
+            status_code=404,
+            detail="tracemalloc is off; start the server with TRACEMALLOC_FRAMES=25"
+        )
+    snapshot = tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, "<frozen *>"),
+        tracemalloc.Filter(False, tracemalloc.__file__),
+    ))
+    if _heap_baseline is None:
+        stats = snapshot.statistics("lineno")
+    else:
+        stats = snapshot.compare_to(_heap_baseline, "lineno")
+    _heap_baseline = snapshot
+    current, peak = tracemalloc.get_traced_memory()
+    return {
+        "traced_mb": current / (1 << 20),
+        "traced_peak_mb": peak / (1 << 20),
+        "top": [str(stat) for stat in stats[:top]],
+    }
+
+
 @app.post("/warmup")
 async def warmup():
     """
@@ -83,15 +317,17 @@ async def warmup():
     """
     try:
         logger.info("Warming up agent (loading FAISS index)...")
-        # Trigger a simple question to load the index
-        agent.ask("warmup")
+        # Trigger a simple question to load the index (off the event loop)
+        agent = get_agent()
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, agent.ask, "warmup")
         logger.info("Warmup completed successfully")
         return {
             "status": "success",
             "message": "Agent warmed up successfully. FAISS index loaded into memory."
         }
     except Exception as e:
-        logger.error(f"Warmup failed: {str(e)}")
+        logger.error("Warmup failed: %s", e)
         return {
             "status": "partial",
             "message": f"Warmup completed with warnings: {str(e)}"
@@ -99,7 +335,10 @@ async def warmup():
 
 
 @app.post("/ask", response_model=AnswerResponse)
-async def ask_question(request: QuestionRequest):
+async def ask_question(
+    request: QuestionRequest,
+    sem: asyncio.Semaphore = Depends(get_openai_semaphore),
+):
     """
     Ask a natural language question about member data.
     
@@ -109,9 +348,9 @@ async def ask_question(request: QuestionRequest):
     3. Generate an accurate answer using LLM
     
     Performance characteristics:
-    - First request: ~2-3 seconds (loads FAISS index from disk)
-    - Subsequent requests: ~1-2 seconds (uses cached index)
+    - Requests: ~1-2 seconds (FAISS index is pre-loaded at startup)
     - Main latency: OpenAI API call (~1-2 seconds)
+    - Repeated questions: served from the in-memory answer cache
     
     Memory optimized for 512MB environments (Render starter pack).
     
@@ -122,50 +361,136 @@ async def ask_question(request: QuestionRequest):
         AnswerResponse with the generated answer
         
     Raises:
-        HTTPException: If question is empty or processing fails
+        HTTPException: If processing fails (empty or oversized questions
+        are rejected with 422 by QuestionRequest validation)
     """
-    import time
-    import gc
+    start_time = _now()
+    question = request.question
     
-    start_time = time.time()
+    try:
+        _log_info("Received question: %s", question)
+        
+        # Get answer from agent without blocking the event loop
+        ask_cached = get_agent().ask_cached
+        async with sem:
+            answer, cache_hit = await _get_running_loop().run_in_executor(None, ask_cached, question)
+        
+        elapsed_time = _now() - start_time
+        if logger.isEnabledFor(logging.INFO):
+            _log_info("Generated answer in %.2fs (cache_hit=%s): %s...", elapsed_time, cache_hit, answer[:100])
+        
+        return AnswerResponse(answer=answer, cache_hit=cache_hit)
     
+    except Exception as e:
+        _log_error("Error processing question: %s", e)
+        raise HTTPException(
+            status_code=500,
+            detail=f"Error processing question: {str(e)}"
+        )
+
+
+def _sse_event(data: str, event: str = None) -> str:
+    """Format a server-sent event (multi-line data is split across data: lines)."""
+    lines = [f"event: {event}"] if event else []
+    lines.extend(f"data: {line}" for line in data.split("\n"))
+    return "\n".join(lines) + "\n\n"
+
+
+async def _stream_answer(question: str, sem: asyncio.Semaphore) -> AsyncIterator[str]:
+    """Yield the agent's streamed answer as SSE events, ending with a done event."""
+    start_time = time.perf_counter()
     try:
-        logger.info(f"Received question: {request.question}")
+        async with sem:
+            async for token in get_agent().astream(question):
+                yield _sse_event(token)
+        yield _sse_event("", event="done")
+        elapsed_time = time.perf_counter() - start_time
+        logger.info("Streamed answer in %.2fs", elapsed_time)
+    except Exception as e:
+        # Headers are already sent, so report the failure in-band
+        logger.error("Error streaming answer: %s", e)
+        yield _sse_event(f"Error processing question: {str(e)}", event="error")
+
+
+@app.post("/ask-stream")
+async def ask_stream(
+    request: QuestionRequest,
+    sem: asyncio.Semaphore = Depends(get_openai_semaphore),
+):
+    """
+    Ask a question and stream the answer as server-sent events.
+    
+    Retrieval runs first, then the answer is forwarded token by token as
+    the LLM generates it, so clients see the first words after retrieval
+    and prompt prefill instead of waiting for the complete answer.
+    
+    Each token is sent as a "data:" event; the stream ends with a "done"
+    event, or an "error" event if generation fails mid-stream. Empty or
+    oversized questions are rejected with 422 by QuestionRequest
+    validation before the stream starts.
+    
+    Args:
+        request: QuestionRequest containing the question
         
-        if not request.question or len(request.question.strip()) == 0:
-            raise HTTPException(
-                status_code=400,
-                detail="Question cannot be empty"
-            )
+    Returns:
+        StreamingResponse with media type text/event-stream
+    """
+    logger.info("Received streaming question: %s", request.question)
+    return StreamingResponse(
+        _stream_answer(request.question, sem),
+        media_type="text/event-stream"
+    )
+
+
+@app.post("/ask-batch", response_model=List[AnswerResponse])
+async def ask_batch(
+    request: BatchQuestionRequest,
+    sem: asyncio.Semaphore = Depends(get_openai_semaphore),
+):
+    """
+    Ask several natural language questions in a single call.
+    
+    Questions are answered concurrently on the executor, so the batch
+    takes roughly as long as its slowest question instead of the sum.
+    Answers are returned in the same order as the questions.
+    
+    Args:
+        request: BatchQuestionRequest containing the questions
         
-        # Get answer from agent
-        answer = agent.ask(request.question)
+    Returns:
+        List of AnswerResponse, one per question
         
-        # MEMORY OPTIMIZATION: Force garbage collection after request
-        gc.collect()
+    Raises:
+        HTTPException: If processing fails (empty or oversized questions
+        are rejected with 422 by BatchQuestionRequest validation)
+    """
+    try:
+        logger.info("Received batch of %s questions", len(request.questions))
+        agent = get_agent()
+        loop = asyncio.get_running_loop()
         
-        elapsed_time = time.time() - start_time
-        logger.info(f"Generated answer in {elapsed_time:.2f}s: {answer[:100]}...")
+        async def _ask(question: str):
+            async with sem:
+                return await loop.run_in_executor(None, agent.ask_cached, question)
         
-        return AnswerResponse(answer=answer)
+        results = await asyncio.gather(*(_ask(question) for question in request.questions))
+        return [
+            AnswerResponse(answer=answer, cache_hit=cache_hit)
+            for answer, cache_hit in results
+        ]
     
-    except HTTPException:
-        raise
     except Exception as e:
-        logger.error(f"Error processing question: {str(e)}")
-        # Force GC even on error to clean up partial state
-        import gc
-        gc.collect()
+        logger.error("Error processing question batch: %s", e)
         raise HTTPException(
             status_code=500,
-            detail=f"Error processing question: {str(e)}"
+            detail=f"Error processing question batch: {str(e)}"
         )
 
 
 @app.post("/clear-cache", response_model=CacheClearResponse)
 async def clear_cache():
     """
-    Clear the member data cache to force refresh from API.
+    Clear the member data cache and cached answers to force refresh from API.
     
     Use this endpoint when the member data has been updated
     and you want to fetch the latest information.
@@ -177,29 +502,60 @@ async def clear_cache():
         HTTPException: If cache clearing fails
     """
     try:
-        agent.clear_cache()
+        agent = get_agent()
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, agent.clear_cache)
         logger.info("Cache cleared successfully")
         return CacheClearResponse(
             status="success",
             message="Cache cleared successfully"
         )
     except Exception as e:
-        logger.error(f"Error clearing cache: {str(e)}")
+        logger.error("Error clearing cache: %s", e)
         raise HTTPException(
             status_code=500,
             detail=f"Error clearing cache: {str(e)}"
         )
 
 
+class JsonAccessFormatter(logging.Formatter):
+    """Format uvicorn access log records as single-line JSON objects."""
+    
+    def format(self, record: logging.LogRecord) -> str:
+        client_addr, method, path, http_version, status_code = record.args
+        return json.dumps({
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "client": client_addr,
+            "method": method,
+            "path": path,
+            "http_version": http_version,
+            "status": status_code,
+        })
+
+
 if __name__ == "__main__":
+    import copy
     import uvicorn
+    from uvicorn.config import LOGGING_CONFIG
+    
+    # Structured (JSON) access logs; other uvicorn logs keep the default format
+    log_config = copy.deepcopy(LOGGING_CONFIG)
+    log_config["formatters"]["access"] = {"()": "app.main.JsonAccessFormatter"}
     
-    # Run the server
+    # Run the server with one process per worker (WEB_CONCURRENCY) on the
+    # uvloop event loop and httptools parser (both ship with uvicorn[standard]).
+    # Each worker loads the same FAISS index file via mmap, so index pages are
+    # shared through the OS page cache rather than duplicated per worker.
+    # For auto-reload during development use: uvicorn app.main:app --reload
     uvicorn.run(
         "app.main:app",
         host="0.0.0.0",
         port=8000,
-        reload=True,
+        workers=int(os.getenv("WEB_CONCURRENCY", "2")),
+        loop="uvloop",
+        http="httptools",
+        log_config=log_config,
         log_level="info"
     )
 
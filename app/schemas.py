@@ -2,12 +2,23 @@
 Pydantic schemas for API request/response models.
 """
 
-from pydantic import BaseModel, Field
+from typing import List
+from typing_extensions import Annotated
+from pydantic import BaseModel, Field, StringConstraints
+
+# Question text: surrounding whitespace stripped, then 1-2000 characters.
+# Enforced during request parsing, so invalid questions are rejected (422)
+# before reaching the agent or the LLM.
+MAX_QUESTION_LENGTH = 2000
+QuestionText = Annotated[
+    str,
+    StringConstraints(strip_whitespace=True, min_length=1, max_length=MAX_QUESTION_LENGTH),
+]
 
 
 class QuestionRequest(BaseModel):
     """Request model for asking questions."""
-    question: str = Field(..., description="Natural language question about member data")
+    question: QuestionText = Field(..., description="Natural language question about member data")
 
     class Config:
         json_schema_extra = {
@@ -17,14 +28,36 @@ class QuestionRequest(BaseModel):
         }
 
 
+class BatchQuestionRequest(BaseModel):
+    """Request model for asking several questions in one call."""
+    questions: List[QuestionText] = Field(
+        ...,
+        min_length=1,
+        max_length=25,
+        description="Natural language questions about member data (answered concurrently)",
+    )
+
+    class Config:
+        json_schema_extra = {
+            "example": {
+                "questions": [
+                    "When is Layla planning her trip to London?",
+                    "Who likes Italian restaurants?",
+                ]
+            }
+        }
+
+
 class AnswerResponse(BaseModel):
     """Response model for answers."""
     answer: str = Field(..., description="Answer to the question based on member data")
+    cache_hit: bool = Field(False, description="Whether the answer was served from the answer cache")
 
     class Config:
         json_schema_extra = {
             "example": {
-                "answer": "Layla Kawaguchi is planning a trip to London, but the exact date is not specified in the messages."
+                "answer": "Layla Kawaguchi is planning a trip to London, but the exact date is not specified in the messages.",
+                "cache_hit": False
             }
         }
 
@@ -6,7 +6,8 @@ Simple script to verify the Messages API is accessible and working.
 """
 
 import os
-import requests
+import asyncio
+import httpx
 from dotenv import load_dotenv
 from rich.console import Console
 from rich.panel import Panel
@@ -21,24 +22,27 @@ API_URL = os.getenv(
 )
 API_KEY = os.getenv("MESSAGES_API_KEY")
 
+# Shared keep-alive client so repeated checks reuse the TCP/TLS connection
+_client = httpx.AsyncClient(
+    http2=True,
+    timeout=10.0,
+    headers={"Authorization": f"Bearer {API_KEY}"} if API_KEY else None,
+)
+
 
-def check_api():
+async def check_api():
     """Quick check of the Messages API."""
     console.print("\n[bold cyan]🔍 Checking Messages API...[/bold cyan]\n")
     
     try:
-        headers = {}
         if API_KEY:
-            headers["Authorization"] = f"Bearer {API_KEY}"
             console.print("[dim]Using authentication[/dim]")
         else:
             console.print("[dim]No authentication (API key not set)[/dim]")
         
-        response = requests.get(
+        response = await _client.get(
             API_URL,
             params={"skip": 0, "limit": 1},
-            headers=headers,
-            timeout=10
         )
         
         if response.status_code == 200:
@@ -79,7 +83,7 @@ def check_api():
             )
             return False
             
-    except requests.exceptions.Timeout:
+    except httpx.TimeoutException:
         console.print(
             Panel(
                 f"[bold red]✗ Timeout[/bold red]\n\n"
@@ -89,7 +93,7 @@ def check_api():
             )
         )
         return False
-    except requests.exceptions.ConnectionError:
+    except httpx.ConnectError:
         console.print(
             Panel(
                 f"[bold red]✗ Connection Error[/bold red]\n\n"
@@ -112,8 +116,16 @@ def check_api():
         return False
 
 
+async def main():
+    """Run the API check and close the shared client."""
+    try:
+        return await check_api()
+    finally:
+        await _client.aclose()
+
+
 if __name__ == "__main__":
-    success = check_api()
+    success = asyncio.run(main())
     console.print()
     exit(0 if success else 1)
 
@@ -5,23 +5,46 @@ This module constructs the RAG workflow using FAISS and semantic search.
 """
 
 import os
+import asyncio
 import logging
-from typing import Optional
-from dotenv import load_dotenv
+import threading
+from typing import Optional, AsyncIterator, List, Tuple, Literal, Callable, Union
+from cachetools import TTLCache
 
 from langchain_openai import ChatOpenAI, OpenAIEmbeddings
 from langgraph.graph import StateGraph, END, START
 
+from langgraph_agent.env import load_env
 from langgraph_agent.state import AgentState
 from langgraph_agent.nodes import RAGNodes
-from langgraph_agent.utils import MESSAGES_API_URL
+from langgraph_agent.embedding_cache import create_embedding_cache
+from langgraph_agent.utils import MESSAGES_API_URL, EMBED_BATCH_SIZE, EMBED_CONCURRENCY, IVF_NPROBE, OPENAI_MAX_EMBED_INPUTS
 
-load_dotenv()
+load_env()
 
 logger = logging.getLogger(__name__)
 
 # OpenAI Configuration
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+PROMPT_CACHE_KEY = os.getenv("PROMPT_CACHE_KEY", "qna-v2")
+
+# Embedding backends: OpenAI API, or a local ONNX model via fastembed (no
+# network round-trip per query; install with `pip install fastembed`)
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "openai")
+DEFAULT_EMBEDDING_MODELS = {
+    "openai": "text-embedding-3-small",
+    "fastembed": "BAAI/bge-small-en-v1.5",
+}
+
+# Answer cache configuration (repeated questions skip retrieval and the LLM)
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "512"))
+ANSWER_CACHE_TTL = int(os.getenv("ANSWER_CACHE_TTL", "3600"))  # seconds
+
+# Max answers generated concurrently by aask_many()
+ASK_MANY_CONCURRENCY = int(os.getenv("ASK_MANY_CONCURRENCY", "6"))
+
+# Probe question used by the /warmup endpoint; never cached
+WARMUP_QUESTION = "warmup"
 
 
 class QnAAgent:
@@ -50,11 +73,16 @@ class QnAAgent:
         self,
         api_url: str = MESSAGES_API_URL,
         llm_model: str = "gpt-5-nano",
-        embedding_model: str = "text-embedding-3-small",
+        embedding_model: str = None,
         openai_api_key: Optional[str] = None,
         index_dir: str = "./faiss_index",
         k: int = None,
         doc_strategy: str = None,
+        index_type: str = None,
+        embed_batch_size: int = EMBED_BATCH_SIZE,
+        embed_concurrency: int = EMBED_CONCURRENCY,
+        embedding_backend: Literal["openai", "fastembed"] = None,
+        nprobe: int = IVF_NPROBE,
     ):
         """
         Initialize the RAG-based QnA agent.
@@ -62,35 +90,61 @@ class QnAAgent:
         Args:
             api_url: URL of the messages API
             llm_model: Name of the OpenAI LLM model (default: gpt-5-nano)
-            embedding_model: Name of the OpenAI embedding model (default: text-embedding-3-small)
+            embedding_model: Name of the embedding model (default: text-embedding-3-small for
+                           "openai", BAAI/bge-small-en-v1.5 for "fastembed")
             openai_api_key: OpenAI API key (defaults to env var)
             index_dir: Directory to save/load FAISS index
             k: Number of documents to retrieve per query (default: from env or 5)
             doc_strategy: Document creation strategy - "individual", "aggregated", or "hybrid" (default: from env or individual)
+            index_type: FAISS index type - "flat", "fp16", "sq8", "hnsw", or "ivfpq" (default: from env or flat)
+            embed_batch_size: Documents per embedding request when building the index (default: from env or 2048)
+            embed_concurrency: Maximum concurrent embedding requests when building the index (default: from env or 8)
+            embedding_backend: "openai" or "fastembed" (local ONNX model, 384-dim vectors).
+                               An existing index must be rebuilt after switching backends.
+                               (default: from env or openai)
+            nprobe: Inverted lists scanned per query on "ivfpq" indexes (default: IVF_NPROBE env or 16)
         """
+        self.embedding_backend = embedding_backend or EMBEDDING_BACKEND
+        if self.embedding_backend not in DEFAULT_EMBEDDING_MODELS:
+            raise ValueError(f"Unknown embedding backend: {self.embedding_backend}")
+        
         self.api_url = api_url
         self.llm_model = llm_model
-        self.embedding_model = embedding_model
+        self.embedding_model = embedding_model or DEFAULT_EMBEDDING_MODELS[self.embedding_backend]
         self.index_dir = index_dir
         # Use environment variables for memory optimization
         # OPTIMIZED: Default k reduced from 5 to 3 for better memory usage
         self.k = k if k is not None else int(os.getenv("RETRIEVAL_K", "3"))
         self.doc_strategy = doc_strategy if doc_strategy is not None else os.getenv("DOC_STRATEGY", "individual")
+        self.index_type = index_type if index_type is not None else os.getenv("INDEX_TYPE", "flat")
         
         api_key = openai_api_key or OPENAI_API_KEY
         
-        # Initialize LLM
+        # Initialize LLM (prompt_cache_key routes requests sharing our static
+        # system prompt prefix to the same OpenAI prompt cache; streaming lets
+        # astream() forward tokens as they are generated)
         self.llm = ChatOpenAI(
             model=llm_model,
             api_key=api_key,
             temperature=0.1,
+            streaming=True,
+            extra_body={"prompt_cache_key": PROMPT_CACHE_KEY},
         )
         
         # Initialize embeddings model
-        self.embeddings = OpenAIEmbeddings(
-            model=embedding_model,
-            api_key=api_key,
-        )
+        if self.embedding_backend == "fastembed":
+            self.embeddings = _create_fastembed_embeddings(self.embedding_model)
+        else:
+            self.embeddings = OpenAIEmbeddings(
+                model=self.embedding_model,
+                api_key=api_key,
+                # Send each batch from the index build as one request instead of
+                # letting LangChain re-split it into its default 1000-input chunks
+                chunk_size=min(embed_batch_size, OPENAI_MAX_EMBED_INPUTS),
+            )
+        
+        # Serve previously embedded texts (documents and questions) from disk
+        self.embeddings = create_embedding_cache(self.embeddings, self.embedding_model, index_dir)
         
         # Initialize RAG nodes
         self.nodes = RAGNodes(
@@ -100,12 +154,33 @@ class QnAAgent:
             index_dir=self.index_dir,
             k=self.k,
             doc_strategy=self.doc_strategy,
+            index_type=self.index_type,
+            embed_batch_size=embed_batch_size,
+            embed_concurrency=embed_concurrency,
+            embedding_model=self.embedding_model,
+            nprobe=nprobe,
         )
         
         # Build the graph
         self._graph = self._build_graph()
         
-        logger.info(f"RAG Agent initialized with {llm_model} and {embedding_model}")
+        # Answer cache keyed by (normalized question, index version).
+        # TTLCache is not thread-safe and requests run on a threadpool.
+        self._answer_cache = TTLCache(maxsize=ANSWER_CACHE_SIZE, ttl=ANSWER_CACHE_TTL)
+        self._answer_cache_lock = threading.Lock()
+        self._index_version = 0
+        
+        # Pre-built initial state; each request takes a shallow copy
+        self._state_template: AgentState = {
+            "messages": [],
+            "question": "",
+            "top_doc_ids": [],
+            "relevant_context": "",
+            "answer": "",
+            "on_token": None,
+        }
+        
+        logger.info("RAG Agent initialized with %s and %s (%s)", llm_model, self.embedding_model, self.embedding_backend)
 
     def _build_graph(self):
         """
@@ -133,7 +208,7 @@ class QnAAgent:
         logger.info("RAG workflow built successfully")
         return workflow.compile()
 
-    def ask(self, question: str) -> str:
+    def ask(self, question: str, on_token: Optional[Callable[[str], None]] = None) -> str:
         """
         Ask a question and get an answer using RAG.
         
@@ -144,40 +219,235 @@ class QnAAgent:
         
         Args:
             question: Natural language question about member data
+            on_token: Optional callback receiving answer text as it is generated
             
         Returns:
             Answer string
         """
-        initial_state: AgentState = {
-            "messages": [],
-            "question": question,
-            "top_docs": [],
-            "relevant_context": "",
-            "answer": "",
-        }
+        answer, _ = self.ask_cached(question, on_token)
+        return answer
+
+    def ask_cached(self, question: str, on_token: Optional[Callable[[str], None]] = None) -> Tuple[str, bool]:
+        """
+        Ask a question, serving repeated questions from the answer cache.
         
-        logger.info(f"Processing question with RAG: {question}")
+        Questions are matched after lowercasing and collapsing whitespace.
+        Entries expire after ANSWER_CACHE_TTL seconds and are invalidated
+        by clear_cache(). The warmup probe question is never cached.
+        
+        Args:
+            question: Natural language question about member data
+            on_token: Optional callback receiving answer text as it is
+                      generated (a cached answer is passed in one call)
+            
+        Returns:
+            Tuple of (answer, cache_hit)
+        """
+        key = self._cache_key(question)
+        if key is not None:
+            with self._answer_cache_lock:
+                answer = self._answer_cache.get(key)
+            if answer is not None:
+                logger.info("Answer cache hit: %s", question)
+                if on_token is not None:
+                    on_token(answer)
+                return answer, True
+        
+        initial_state = self._initial_state(question)
+        initial_state["on_token"] = on_token
+        
+        logger.info("Processing question with RAG: %s", question)
         final_state = self._graph.invoke(initial_state)
+        answer = final_state["answer"]
+        self._store_answer(key, answer)
         
-        return final_state["answer"]
+        return answer, False
+
+    def ask_many(self, questions: List[str]) -> List[str]:
+        """
+        Answer several questions, retrieving context for all of them at once.
+        
+        Questions not in the answer cache are embedded together in one
+        request (see RAGNodes.retrieve_context_batch), then answered one
+        after another. Answers are cached as in ask_cached().
+        
+        Args:
+            questions: Natural language questions about member data
+            
+        Returns:
+            Answer strings, in the same order as questions
+        """
+        keys, answers = self._cached_answers(questions)
+        pending = [i for i, answer in enumerate(answers) if answer is None]
+        if pending:
+            logger.info("Processing %s questions with RAG (batched retrieval)", len(pending))
+            states = self._retrieve_many([questions[i] for i in pending])
+            for i, state in zip(pending, states):
+                answers[i] = self.nodes.generate_answer(state)["answer"]
+                self._store_answer(keys[i], answers[i])
+        return answers
+
+    async def aask_many(self, questions: List[str], concurrency: int = ASK_MANY_CONCURRENCY) -> List[Union[str, BaseException]]:
+        """
+        Async version of ask_many() that generates the answers concurrently.
+        
+        Retrieval is batched as in ask_many() and runs on the executor; the
+        LLM calls are independent, so up to `concurrency` of them run at
+        once and wall time is about that of the slowest answer rather than
+        the sum. A failed LLM call only fails its own question: the other
+        answers are still returned and cached.
+        
+        Args:
+            questions: Natural language questions about member data
+            concurrency: Maximum answers generated at once
+            
+        Returns:
+            Answer strings in the same order as questions, with the
+            exception in place of any answer whose generation failed
+            
+        Raises:
+            Exception: If batched retrieval fails (no answer was generated)
+        """
+        keys, answers = self._cached_answers(questions)
+        pending = [i for i, answer in enumerate(answers) if answer is None]
+        if not pending:
+            return answers
+        
+        logger.info("Processing %s questions with RAG (batched retrieval, async)", len(pending))
+        loop = asyncio.get_running_loop()
+        states = await loop.run_in_executor(None, self._retrieve_many, [questions[i] for i in pending])
+        
+        semaphore = asyncio.Semaphore(concurrency)
+        
+        async def _generate(state: AgentState) -> str:
+            async with semaphore:
+                final_state = await loop.run_in_executor(None, self.nodes.generate_answer, state)
+                return final_state["answer"]
+        
+        generated = await asyncio.gather(*(_generate(state) for state in states), return_exceptions=True)
+        for i, answer in zip(pending, generated):
+            answers[i] = answer
+            if isinstance(answer, BaseException):
+                logger.warning("Answering %r failed: %s", questions[i], answer)
+            else:
+                self._store_answer(keys[i], answer)
+        return answers
+
+    def _cached_answers(self, questions: List[str]) -> Tuple[List, List[Optional[str]]]:
+        """Answer cache keys for the questions, and their cached answers (None if missing)."""
+        keys = [self._cache_key(question) for question in questions]
+        with self._answer_cache_lock:
+            answers = [self._answer_cache.get(key) if key is not None else None for key in keys]
+        return keys, answers
+
+    def _store_answer(self, key: Optional[Tuple[str, int]], answer: str):
+        """Cache an answer under its key (no-op for uncacheable questions)."""
+        if key is not None:
+            with self._answer_cache_lock:
+                self._answer_cache[key] = answer
+
+    def _cache_key(self, question: str) -> Optional[Tuple[str, int]]:
+        """Build the answer cache key, or None if the question must not be cached."""
+        normalized = " ".join(question.lower().split())
+        if normalized == WARMUP_QUESTION:
+            return None
+        return (normalized, self._index_version)
+
+    async def astream(self, question: str) -> AsyncIterator[str]:
+        """
+        Answer a question, yielding the answer text as the LLM produces it.
+        
+        Index loading and retrieval run on the executor (they are blocking),
+        then the answer is streamed from the LLM token by token, so the
+        first token arrives after retrieval + prefill rather than after the
+        full completion.
+        
+        Args:
+            question: Natural language question about member data
+            
+        Yields:
+            Chunks of the answer string
+        """
+        logger.info("Processing question with RAG (streaming): %s", question)
+        loop = asyncio.get_running_loop()
+        state = await loop.run_in_executor(None, self._retrieve, question)
+        
+        messages = self.nodes.build_answer_messages(question, state["relevant_context"])
+        async for chunk in self.llm.astream(messages):
+            if chunk.content:
+                yield chunk.content
+
+    def _retrieve(self, question: str) -> AgentState:
+        """Run the load/index and retrieval nodes for a question (blocking)."""
+        state = self._initial_state(question)
+        state = self.nodes.load_and_index(state)
+        return self.nodes.retrieve_context(state)
+
+    def _retrieve_many(self, questions: List[str]) -> List[AgentState]:
+        """Run the load/index node once and batched retrieval for the questions (blocking)."""
+        states = [self._initial_state(question) for question in questions]
+        self.nodes.load_and_index(states[0])
+        return self.nodes.retrieve_context_batch(states)
+
+    def _initial_state(self, question: str) -> AgentState:
+        """Build the initial graph state for a question from the template."""
+        state = self._state_template.copy()
+        state["question"] = question
+        return state
+
+    def warmup(self):
+        """
+        Load the FAISS index into memory without answering a question.
+        
+        Call this before serving traffic so the first real request
+        doesn't pay the index load/build cost.
+        """
+        self.nodes.warmup()
 
     def clear_cache(self):
         """
-        Clear the FAISS vectorstore cache to force rebuild.
+        Clear the FAISS vectorstore cache and the answer cache.
         
         Use this when the member data has been updated and you want
         to rebuild the index from the latest API data.
         """
         self.nodes.clear_cache()
+        
+        # Bump the version so answers computed against the old index (even
+        # ones still in flight) can never be served again
+        with self._answer_cache_lock:
+            self._index_version += 1
+            self._answer_cache.clear()
         logger.info("RAG cache cleared")
 
 
+def _create_fastembed_embeddings(model_name: str):
+    """
+    Create a local fastembed (ONNX Runtime) embeddings model.
+    
+    Args:
+        model_name: fastembed model name (e.g., BAAI/bge-small-en-v1.5)
+        
+    Returns:
+        LangChain embeddings exposing embed_documents/embed_query
+    """
+    try:
+        from langchain_community.embeddings import FastEmbedEmbeddings
+        return FastEmbedEmbeddings(model_name=model_name)
+    except ImportError as e:
+        raise ImportError(
+            "EMBEDDING_BACKEND=fastembed requires the fastembed package: pip install fastembed"
+        ) from e
+
+
 def create_agent(
     api_url: str = MESSAGES_API_URL,
     llm_model: str = "gpt-5-nano",
-    embedding_model: str = "text-embedding-3-small",
+    embedding_model: str = None,
     k: int = None,
     doc_strategy: str = None,
+    index_type: str = None,
+    embedding_backend: str = None,
 ) -> QnAAgent:
     """
     Factory function to create a RAG-based QnA agent instance.
@@ -185,9 +455,11 @@ def create_agent(
     Args:
         api_url: URL of the messages API
         llm_model: Name of the OpenAI LLM model
-        embedding_model: Name of the OpenAI embedding model
+        embedding_model: Name of the embedding model (default depends on embedding_backend)
         k: Number of documents to retrieve per query (default: from env or 5)
         doc_strategy: Document creation strategy (default: from env or individual)
+        index_type: FAISS index type (default: from env or flat)
+        embedding_backend: "openai" or "fastembed" (default: from env or openai)
         
     Returns:
         Initialized RAG QnA agent
@@ -198,5 +470,7 @@ def create_agent(
         embedding_model=embedding_model,
         k=k,
         doc_strategy=doc_strategy,
+        index_type=index_type,
+        embedding_backend=embedding_backend,
     )
 
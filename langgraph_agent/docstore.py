@@ -0,0 +1,125 @@
+"""
+Read-only, lazily loaded docstore backed by a JSONL file.
+
+Saved indexes keep their documents in docstore.jsonl (one document per
+line, in FAISS row order). Loading only records each document's id and
+line offset; documents are parsed when looked up, so only the ids,
+offsets and a bounded cache of parsed documents stay in RAM instead of
+every Document object.
+"""
+
+import os
+import json
+import logging
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, Iterator, List, Tuple, Union
+
+from langchain_core.documents import Document
+from langchain_community.docstore.base import Docstore
+
+from langgraph_agent.env import load_env
+
+load_env()
+
+logger = logging.getLogger(__name__)
+
+DOCSTORE_FILE = "docstore.jsonl"
+
+# Parsed documents kept in memory per docstore
+DOCSTORE_CACHE_SIZE = int(os.getenv("DOCSTORE_CACHE_SIZE", "4096"))
+
+
+def save_docstore_jsonl(
+    docstore: Docstore,
+    index_to_docstore_id: Dict[int, str],
+    index_dir: str = "./faiss_index",
+):
+    """
+    Write a docstore as JSONL, one line per FAISS row id.
+
+    Each line is `<json id>\\t<json document>`, so the id can be read back
+    without parsing the document.
+
+    Args:
+        docstore: Docstore holding the documents
+        index_to_docstore_id: FAISS row id -> docstore id
+        index_dir: Directory where the index is saved
+    """
+    index_path = Path(index_dir)
+    index_path.mkdir(parents=True, exist_ok=True)
+    # Write then rename so a crash never leaves a half-written file
+    tmp_path = index_path / f"{DOCSTORE_FILE}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        for i in range(len(index_to_docstore_id)):
+            doc_id = index_to_docstore_id[i]
+            doc = docstore.search(doc_id)
+            record = {"page_content": doc.page_content, "metadata": doc.metadata}
+            f.write(f"{json.dumps(doc_id)}\t{json.dumps(record, ensure_ascii=False)}\n")
+    tmp_path.replace(index_path / DOCSTORE_FILE)
+
+
+class JsonlDocstore(Docstore):
+    """
+    Docstore that reads documents from a JSONL file on demand.
+
+    Lookups read a single line with os.pread (safe to share across threads)
+    and recently used documents are kept in an LRU cache.
+    """
+
+    def __init__(self, path: Union[str, Path], cache_size: int = DOCSTORE_CACHE_SIZE):
+        """
+        Index the file's line offsets without parsing any documents.
+
+        Args:
+            path: docstore.jsonl written by save_docstore_jsonl()
+            cache_size: Max parsed documents kept in memory
+        """
+        self.path = Path(path)
+        self.ids: List[str] = []
+        self._offsets: Dict[str, Tuple[int, int]] = {}
+
+        offset = 0
+        with open(self.path, "rb") as f:
+            for line in f:
+                doc_id = json.loads(line[:line.index(b"\t")])
+                self.ids.append(doc_id)
+                self._offsets[doc_id] = (offset, len(line))
+                offset += len(line)
+
+        self._fd = os.open(self.path, os.O_RDONLY)
+        self._cached_read = lru_cache(maxsize=cache_size)(self._read)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def _read(self, doc_id: str) -> Document:
+        """Read and parse one document (uncached)."""
+        offset, length = self._offsets[doc_id]
+        line = os.pread(self._fd, length, offset)
+        record = json.loads(line[line.index(b"\t") + 1:])
+        return Document(page_content=record["page_content"], metadata=record["metadata"])
+
+    def search(self, search: str) -> Union[str, Document]:
+        """
+        Look up a document by docstore id.
+
+        Returns:
+            The Document, or an error string if the id is unknown (same
+            contract as InMemoryDocstore)
+        """
+        if search not in self._offsets:
+            return f"ID {search} not found."
+        return self._cached_read(search)
+
+    def iter_documents(self) -> Iterator[Document]:
+        """Yield every document in file (FAISS row) order, bypassing the cache."""
+        with open(self.path, "rb") as f:
+            for line in f:
+                record = json.loads(line[line.index(b"\t") + 1:])
+                yield Document(page_content=record["page_content"], metadata=record["metadata"])
+
+    def __del__(self):
+        fd = getattr(self, "_fd", None)
+        if fd is not None:
+            os.close(fd)
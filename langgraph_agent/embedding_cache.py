@@ -0,0 +1,164 @@
+"""
+Persistent, content-addressed cache in front of an embeddings model.
+
+Vectors are stored in SQLite keyed by a BLAKE2b hash of (model, text), so
+rebuilding the index or asking a question seen before (even after a
+restart) reads the vector from disk instead of calling the embeddings API.
+"""
+
+import os
+import hashlib
+import logging
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Union
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from langgraph_agent.env import load_env
+
+load_env()
+
+logger = logging.getLogger(__name__)
+
+# SQLite file holding cached vectors ("" disables the cache); by default it
+# lives in the index directory
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH")
+
+# SQLite caps the number of bound parameters per statement
+_SQLITE_MAX_VARIABLES = 900
+
+
+class EmbeddingCache(Embeddings):
+    """
+    Embeddings wrapper that looks vectors up in a local SQLite cache first.
+
+    Only texts missing from the cache are sent to the wrapped model, in one
+    embed_documents / aembed_documents call per request, and their vectors
+    are written back. Safe to share across threads.
+    """
+
+    def __init__(self, embeddings: Embeddings, model_name: str, path: Union[str, Path]):
+        """
+        Args:
+            embeddings: Embeddings model to wrap
+            model_name: Embedding model name, part of every cache key
+            path: SQLite database file (created if missing)
+        """
+        self.embeddings = embeddings
+        self.model_name = model_name
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS embeddings (key BLOB PRIMARY KEY, vector BLOB NOT NULL)")
+        self._conn.commit()
+
+    def _key(self, text: str) -> bytes:
+        """Content address of (model, text)."""
+        return hashlib.blake2b(f"{self.model_name}\0{text}".encode("utf-8"), digest_size=16).digest()
+
+    def _get_many(self, keys: List[bytes]) -> Dict[bytes, List[float]]:
+        """Fetch cached vectors for the given keys (missing keys are absent)."""
+        found = {}
+        with self._lock:
+            for i in range(0, len(keys), _SQLITE_MAX_VARIABLES):
+                chunk = keys[i:i + _SQLITE_MAX_VARIABLES]
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(chunk))})",
+                    chunk,
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype=np.float32).tolist()
+        return found
+
+    def _put_many(self, items: Dict[bytes, List[float]]):
+        """Store vectors for the given keys."""
+        rows = [(key, np.asarray(vector, dtype=np.float32).tobytes()) for key, vector in items.items()]
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)", rows)
+            self._conn.commit()
+
+    def _lookup(self, texts: List[str]):
+        """Split texts into cached vectors and the distinct texts still to embed."""
+        keys = [self._key(text) for text in texts]
+        found = self._get_many(list(set(keys)))
+        missing: Dict[bytes, str] = {}
+        for key, text in zip(keys, texts):
+            if key not in found:
+                missing.setdefault(key, text)
+        if texts:
+            logger.debug("Embedding cache: %s/%s hits", len(texts) - len(missing), len(texts))
+        return keys, found, missing
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys, found, missing = self._lookup(texts)
+        if missing:
+            vectors = self.embeddings.embed_documents(list(missing.values()))
+            new = dict(zip(missing, vectors))
+            self._put_many(new)
+            found.update(new)
+        return [found[key] for key in keys]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys, found, missing = self._lookup(texts)
+        if missing:
+            vectors = await self.embeddings.aembed_documents(list(missing.values()))
+            new = dict(zip(missing, vectors))
+            self._put_many(new)
+            found.update(new)
+        return [found[key] for key in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        # Queries may be embedded differently from documents (e.g. instruction
+        # prefixes), so they get their own key space
+        key = self._key(f"query\0{text}")
+        cached = self._get_many([key]).get(key)
+        if cached is not None:
+            return cached
+        vector = self.embeddings.embed_query(text)
+        self._put_many({key: vector})
+        return vector
+
+    async def aembed_query(self, text: str) -> List[float]:
+        key = self._key(f"query\0{text}")
+        cached = self._get_many([key]).get(key)
+        if cached is not None:
+            return cached
+        vector = await self.embeddings.aembed_query(text)
+        self._put_many({key: vector})
+        return vector
+
+
+def create_embedding_cache(
+    embeddings: Embeddings,
+    model_name: str,
+    index_dir: str = "./faiss_index",
+    path: Optional[str] = EMBEDDING_CACHE_PATH,
+) -> Embeddings:
+    """
+    Wrap an embeddings model with the persistent cache, unless disabled.
+
+    Args:
+        embeddings: Embeddings model to wrap
+        model_name: Embedding model name, part of every cache key
+        index_dir: Index directory; the default cache file lives there
+        path: Cache file (None = <index_dir>/embedding_cache.sqlite, "" = disabled)
+
+    Returns:
+        The cached wrapper, or the model itself when caching is disabled
+    """
+    if path == "":
+        return embeddings
+    if path is None:
+        path = os.path.join(index_dir, "embedding_cache.sqlite")
+    try:
+        return EmbeddingCache(embeddings, model_name, path)
+    except sqlite3.Error as e:
+        logger.warning("Embedding cache unavailable at %s, embedding without it: %s", path, e)
+        return embeddings
@@ -0,0 +1,23 @@
+"""
+One-time .env loading shared by every module that reads configuration.
+
+Modules read their settings into constants at import time, so the .env
+file must be loaded before the first of them is imported. load_env() can
+be called at the top of each such module; only the first call parses the
+file.
+"""
+
+from functools import cache
+
+from dotenv import load_dotenv
+
+
+@cache
+def load_env() -> bool:
+    """
+    Load .env into os.environ once per process (existing variables win).
+
+    Returns:
+        True if a .env file was found and loaded
+    """
+    return load_dotenv(override=False)
@@ -4,8 +4,16 @@ Node functions for the RAG-based LangGraph QnA agent.
 Each node represents a step in the RAG workflow.
 """
 
+import os
+import re
 import logging
-from typing import Optional, List, Tuple
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Optional, List, Tuple, Dict, NamedTuple
+import numpy as np
+import pandas as pd
+from rapidfuzz import fuzz, process
 from langchain_core.messages import SystemMessage, HumanMessage, AIMessage
 from langchain_core.documents import Document
 from langchain_community.vectorstores import FAISS
@@ -13,16 +21,165 @@ from langchain_community.vectorstores import FAISS
 from langgraph_agent.state import AgentState
 from langgraph_agent.utils import (
     fetch_all_messages,
-    messages_to_documents,
+    fetch_corpus_info,
+    corpus_fingerprint,
+    save_index_meta,
+    load_index_meta,
+    messages_to_records,
     build_faiss_index,
+    embed_texts_normalized,
+    deduplicate_vectors,
     save_faiss_index,
+    extend_faiss_index,
     load_faiss_index,
-    semantic_search,
-    format_retrieved_context,
+    embed_query_normalized,
+    embed_queries_normalized,
+    batch_search_ids,
+    best_unique_ids,
+    smallest_k,
+    build_document_table,
+    index_vectors,
+    load_embeddings_matrix,
+    index_is_compressed,
+    rerank_scores,
+    RERANK_FACTOR,
+    move_index_to_gpu,
+    format_context_from_docstore,
+    EMBED_BATCH_SIZE,
+    EMBED_CONCURRENCY,
+    IVF_NPROBE,
 )
 
 logger = logging.getLogger(__name__)
 
+# Semantic retrieval cache: recent question embeddings in a ring buffer. A new
+# question with cosine similarity >= threshold to a cached one (and the same
+# detected names) reuses its retrieved documents instead of searching FAISS.
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", "256"))
+QUERY_CACHE_THRESHOLD = float(os.getenv("QUERY_CACHE_THRESHOLD", "0.95"))
+
+# Shared pool for overlapping independent network calls within one retrieval
+# (created once; threads are reused across requests)
+_SEARCH_POOL = ThreadPoolExecutor(max_workers=4, thread_name_prefix="retrieval")
+
+# Name extraction: words of 2+ characters starting with a letter (hyphenated
+# names and apostrophes such as O'Neil stay whole, a possessive 's is left
+# off), minus common question words, pronouns, weekdays and months
+_SKIP_WORDS = frozenset({
+    'who', 'what', 'when', 'where', 'why', 'how', 'which', 'whose',
+    'i', 'me', 'my', 'mine', 'we', 'us', 'our', 'ours',
+    'you', 'your', 'yours', 'he', 'him', 'his', 'she', 'her', 'hers',
+    'it', 'its', 'they', 'them', 'their', 'theirs',
+    'monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday',
+    'january', 'february', 'march', 'april', 'may', 'june',
+    'july', 'august', 'september', 'october', 'november', 'december'
+})
+# The skip words are baked into a case-insensitive negative lookahead, so one
+# findall pass tokenizes and filters. The lookbehind keeps a rejected word's
+# tail (e.g. "HO" of "WHO") from matching as a word of its own.
+_NAME_RE = re.compile(
+    r"(?<![^\W\d_])(?!(?i:" + "|".join(sorted(_SKIP_WORDS, key=len, reverse=True)) + r")(?![\w-]))[^\W\d_](?:\w|-(?=\w)|['’](?=\w)(?![sS]\b))+"
+)
+
+# Minimum RapidFuzz partial_ratio (0-100) for a question name to match a member name
+NAME_MATCH_CUTOFF = 75
+
+# Topic keywords used by query expansion
+_SUBJECT_KEYWORDS = {
+    'travel': ['travel', 'trip', 'trips', 'vacation', 'journey', 'visit', 'visiting'],
+    'car': ['car', 'cars', 'vehicle', 'vehicles', 'BMW', 'Mercedes', 'Tesla', 'automobile'],
+    'restaurant': ['restaurant', 'restaurants', 'dining', 'food', 'Italian', 'cuisine', 'eatery'],
+    'hotel': ['hotel', 'hotels', 'accommodation', 'stay', 'staying'],
+}
+
+@lru_cache(maxsize=512)
+def _cached_expand_query(question: str, names: Tuple[str, ...]) -> Tuple[str, ...]:
+    """Pure implementation of RAGNodes._expand_query (memoized; no logging)."""
+    queries = [question]
+    
+    question_lower = question.lower()
+    
+    # Detect question type
+    is_who_question = question_lower.startswith('who ')
+    is_what_question = question_lower.startswith('what ')
+    is_counting = any(keyword in question_lower for keyword in ['how many', 'count', 'number of', 'list all', 'what are all'])
+    
+    # Detect the subject/topic with expanded keywords
+    detected_topics = []
+    for topic, keywords in _SUBJECT_KEYWORDS.items():
+        if any(keyword in question_lower for keyword in keywords):
+            detected_topics.append((topic, keywords))
+    
+    # OPTIMIZED: Add ONE most relevant expanded query based on question type
+    if is_who_question and detected_topics:
+        # For "Who has X?" questions, expand with topic synonyms
+        topic, keywords = detected_topics[0]
+        # Use top 3 most relevant synonyms
+        synonym_query = ' '.join(keywords[:3])
+        queries.append(synonym_query)
+    elif is_counting and names and detected_topics:
+        # For counting with name: "How many cars does X have?"
+        name = names[0]
+        topic = detected_topics[0][0]
+        queries.append(f"{name} {topic}")
+    elif names and detected_topics:
+        # For name-based questions: "What are X's restaurants?"
+        name = names[0]
+        topic = detected_topics[0][0]
+        # Add name + topic keywords
+        topic_keywords = detected_topics[0][1][:2]  # Use top 2 keywords
+        queries.append(f"{name} {' '.join(topic_keywords)}")
+    
+    return tuple(queries)
+
+
+@lru_cache(maxsize=512)
+def _cached_extract_names(question: str) -> Tuple[str, ...]:
+    """Pure implementation of RAGNodes._extract_names_from_question (memoized)."""
+    # Capitalization is checked with str.isupper so non-ASCII initials count
+    return tuple(word for word in _NAME_RE.findall(question) if word[0].isupper())
+
+
+class LoadedIndex(NamedTuple):
+    """
+    Everything retrieval reads from a loaded index, swapped as one unit.
+    
+    RAGNodes publishes a new bundle with a single assignment and each
+    request reads it once, so a concurrent clear_cache() or reload can
+    never pair one index's row ids with another index's tables.
+    """
+    vectorstore: FAISS
+    # Per-row lowercase user names, indexed by FAISS row id
+    meta: pd.DataFrame
+    # Inverted index: lowercase user name -> FAISS row ids of their documents
+    user_to_doc_ids: Dict[str, np.ndarray]
+    unique_user_names_lower: List[str]
+    # Stored vectors, indexed by FAISS row id (scores one user's rows directly)
+    embeddings_matrix: np.ndarray
+    # Rerank candidates with exact vectors (compressed index + saved vectors)
+    rerank: bool
+
+
+# Static system prompt. It is sent as the first message of every LLM call and
+# must stay byte-identical (no timestamps/IDs) so OpenAI's prefix cache can hit.
+SYSTEM_PROMPT = """You are a helpful assistant that answers questions about member data.
+Use ONLY the provided context (member messages) to answer questions.
+The context includes messages retrieved via semantic search - they are the most relevant to the question.
+
+IMPORTANT INSTRUCTIONS:
+- Be specific and cite the member's name when providing information.
+- For date/time questions, extract specific dates, days of the week, or time periods mentioned in messages. If a timestamp is provided, use it to give context like "in March 2024" or specific dates.
+- For counting questions (how many, count, list), count ALL unique items mentioned across ALL messages provided.
+- When asked "how many X does Y have?", interpret this as "how many X are mentioned by/about Y?"
+  Examples: "how many cars" = count all car types/brands mentioned (BMW, Tesla, Mercedes, etc.)
+- For aggregation questions like "Who has travel plans?" or "Who likes X?", review EVERY message in the context and list ALL members mentioned. Be exhaustive.
+- Some messages are aggregated (grouped together) and some are individual - use all of them.
+- If you see the same information repeated across multiple messages, count unique items only once.
+- When listing people or items, be thorough and check all messages before responding.
+- For name-based queries, consider common name variations (e.g., Amira might be Amina, or vice versa) - if you find a similar name, mention it.
+- When counting or listing, show your work by mentioning what you found to be transparent.
+- If truly no relevant information exists in the context, say so honestly."""
+
 
 class RAGNodes:
     """
@@ -31,7 +188,18 @@ class RAGNodes:
     This class holds the node functions and manages the FAISS vector store.
     """
     
-    def __init__(self, llm, embeddings, api_url: str, index_dir: str = "./faiss_index", k: int = 3, doc_strategy: str = "individual"):
+    # Fixed attribute layout: no per-instance __dict__, and attribute reads on
+    # the hot retrieval path are slot accesses the interpreter can specialize
+    __slots__ = (
+        "llm", "embeddings", "api_url", "index_dir", "k", "doc_strategy", "index_type",
+        "embed_batch_size", "embed_concurrency", "embedding_model", "nprobe",
+        "_index", "_index_lock",
+        "_qcache_vecs", "_qcache_payload", "_qcache_pos", "_qcache_lock",
+    )
+    
+    def __init__(self, llm, embeddings, api_url: str, index_dir: str = "./faiss_index", k: int = 3, doc_strategy: str = "individual", index_type: str = "flat",
+                 embed_batch_size: int = EMBED_BATCH_SIZE, embed_concurrency: int = EMBED_CONCURRENCY,
+                 embedding_model: str = None, nprobe: int = IVF_NPROBE):
         """
         Initialize RAG nodes.
         
@@ -43,6 +211,12 @@ class RAGNodes:
             k: Number of documents to retrieve (default: 3, OPTIMIZED for 512MB memory)
             doc_strategy: Document creation strategy ("individual", "aggregated", or "hybrid")
                         Note: "hybrid" uses 2x memory, use "individual" for memory-constrained environments
+            index_type: FAISS index type used when building a new index ("flat", "fp16", "sq8", "hnsw", or "ivfpq")
+            embed_batch_size: Documents per embedding request when building the index
+            embed_concurrency: Maximum concurrent embedding requests when building the index
+            embedding_model: Name of the embedding model, recorded with the index so an
+                             index built with a different model is never reused
+            nprobe: Inverted lists scanned per query on IVF indexes (recall vs. latency)
         """
         self.llm = llm
         self.embeddings = embeddings
@@ -50,7 +224,21 @@ class RAGNodes:
         self.index_dir = index_dir
         self.k = k
         self.doc_strategy = doc_strategy
-        self._vectorstore: Optional[FAISS] = None
+        self.index_type = index_type
+        self.embed_batch_size = embed_batch_size
+        self.embed_concurrency = embed_concurrency
+        self.embedding_model = embedding_model
+        self.nprobe = nprobe
+        # The loaded index and its lookup tables (None until first use)
+        self._index: Optional[LoadedIndex] = None
+        # Guards index load/build when requests run concurrently in a threadpool
+        self._index_lock = threading.Lock()
+        
+        # Semantic retrieval cache (ring buffer, allocated once the dim is known)
+        self._qcache_vecs: Optional[np.ndarray] = None
+        self._qcache_payload: List = [None] * QUERY_CACHE_SIZE
+        self._qcache_pos = 0
+        self._qcache_lock = threading.Lock()
     
     def load_and_index(self, state: AgentState) -> AgentState:
         """
@@ -67,30 +255,215 @@ class RAGNodes:
         Returns:
             Updated state (no changes to state, but initializes vectorstore)
         """
-        if self._vectorstore is None:
+        self._ensure_index()
+        return state
+    
+    def _ensure_index(self) -> LoadedIndex:
+        """Return the loaded index bundle, loading or building it on first use."""
+        index = self._index
+        if index is None:
+            with self._index_lock:
+                # Re-check: another request may have loaded the index while we waited
+                index = self._index
+                if index is None:
+                    vectorstore = self._load_or_build_index()
+                    meta = build_document_table(vectorstore)
+                    user_to_doc_ids = meta.groupby("user_name_lower").indices
+                    # Compressed indexes have their exact vectors saved alongside;
+                    # flat/hnsw ones are read back from the index while it is
+                    # still on the CPU
+                    matrix = None
+                    if index_is_compressed(vectorstore.index):
+                        matrix = load_embeddings_matrix(self.index_dir, vectorstore.index.ntotal)
+                    rerank = matrix is not None
+                    if matrix is None:
+                        matrix = index_vectors(vectorstore)
+                    move_index_to_gpu(vectorstore)
+                    if hasattr(vectorstore.index, "nprobe"):
+                        vectorstore.index.nprobe = self.nprobe
+                    index = LoadedIndex(
+                        vectorstore=vectorstore,
+                        meta=meta,
+                        user_to_doc_ids=user_to_doc_ids,
+                        unique_user_names_lower=list(user_to_doc_ids),
+                        embeddings_matrix=matrix,
+                        rerank=rerank,
+                    )
+                    # Publish everything at once
+                    self._index = index
+        else:
+            logger.info("Using existing vectorstore in memory")
+        
+        return index
+    
+    def warmup(self):
+        """
+        Load the FAISS index and touch its pages before serving traffic.
+        
+        Runs a probe search directly on the raw FAISS index so the
+        memory-mapped index pages are faulted into the page cache without
+        calling the embeddings API or the LLM.
+        """
+        index = self._ensure_index().vectorstore.index
+        if index.ntotal > 0:
+            probe = np.zeros((1, index.d), dtype="float32")
+            index.search(probe, min(self.k, index.ntotal))
+        logger.info("FAISS index warmed up (%s vectors)", index.ntotal)
+    
+    def _load_or_build_index(self) -> FAISS:
+        """
+        Load the FAISS index from disk, or build and save it from API data.
+        
+        The saved index is reused only if its index_meta.json matches the
+        current settings (embedding model, doc strategy, index type) and the
+        upstream corpus fingerprint, which costs a single one-message API
+        call instead of re-embedding every message. If the fingerprint
+        can't be fetched, a settings-compatible saved index is still used.
+        If messages were only appended upstream, the saved index is
+        extended with them (see _update_index) instead of rebuilt.
+        
+        Returns:
+            Loaded or newly built FAISS vector store
+        """
+        try:
+            corpus = fetch_corpus_info(self.api_url)
+            corpus_hash = corpus_fingerprint(corpus)
+        except Exception as e:
+            logger.warning("Could not fetch corpus fingerprint, reusing saved index if compatible: %s", e)
+            corpus, corpus_hash = None, None
+        
+        expected_meta = self._index_settings()
+        saved_meta = load_index_meta(self.index_dir)
+        
+        vectorstore = None
+        if saved_meta is None:
+            logger.info("No index metadata found at %s", self.index_dir)
+        elif any(saved_meta.get(key) != value for key, value in expected_meta.items()):
+            logger.info("Saved index was built with different settings (%s), rebuilding", saved_meta)
+        elif corpus_hash is not None and saved_meta.get("corpus_hash") != corpus_hash:
+            vectorstore = self._update_index(saved_meta, corpus, corpus_hash)
+            if vectorstore is None:
+                logger.info("Upstream messages changed since the index was built, rebuilding")
+        else:
             # Try to load existing index
             logger.info("Attempting to load existing FAISS index...")
-            self._vectorstore = load_faiss_index(self.embeddings, self.index_dir)
+            vectorstore = load_faiss_index(self.embeddings, self.index_dir)
+        
+        # If no reusable index exists, build one
+        if vectorstore is None:
+            logger.info("Building new FAISS index with '%s' strategy...", self.doc_strategy)
             
-            # If no index exists, build one
-            if self._vectorstore is None:
-                logger.info(f"No index found. Building new FAISS index with '{self.doc_strategy}' strategy...")
-                
-                # Fetch messages from API
-                messages = fetch_all_messages(self.api_url)
-                
-                # Convert to documents using the specified strategy
-                documents = messages_to_documents(messages, strategy=self.doc_strategy)
-                
-                # Build FAISS index
-                self._vectorstore = build_faiss_index(documents, self.embeddings)
-                
-                # Save for future use
-                save_faiss_index(self._vectorstore, self.index_dir)
-        else:
-            logger.info("Using existing vectorstore in memory")
+            # Fetch messages from API
+            messages = fetch_all_messages(self.api_url)
+            
+            # Convert to (text, metadata) records using the specified strategy
+            texts, metadatas = messages_to_records(messages, strategy=self.doc_strategy)
+            
+            # OPTIMIZED: Embed the plain texts once, drop near-duplicates, and
+            # create Documents only for the survivors (no re-embedding)
+            vectors = embed_texts_normalized(
+                texts,
+                self.embeddings,
+                batch_size=self.embed_batch_size,
+                concurrency=self.embed_concurrency,
+            )
+            keep = deduplicate_vectors(vectors)
+            if len(keep) < len(texts):
+                vectors = vectors[keep]
+            documents = [Document(page_content=texts[i], metadata=metadatas[i]) for i in keep]
+            
+            # Build FAISS index
+            vectorstore = build_faiss_index(
+                documents,
+                self.embeddings,
+                index_type=self.index_type,
+                precomputed_vecs=vectors,
+            )
+            
+            # Save for future use
+            save_faiss_index(vectorstore, self.index_dir, vectors=vectors)
+            save_index_meta(
+                {
+                    **expected_meta,
+                    "corpus_hash": corpus_hash,
+                    "dim": vectorstore.index.d,
+                    "watermark": {
+                        "first_id": messages[0].get("id") if messages else None,
+                        "message_count": len(messages),
+                        "message_ids": [msg.get("id") for msg in messages],
+                    },
+                },
+                self.index_dir,
+            )
+        
+        return vectorstore
+    
+    def _update_index(self, saved_meta: dict, corpus: dict, corpus_hash: str) -> Optional[FAISS]:
+        """
+        Extend the saved index with messages appended upstream since it was built.
         
-        return state
+        The saved watermark records how many messages were indexed and the
+        first message id. If the first id is unchanged and the corpus only
+        grew, just the new messages are fetched (skip=message_count) and
+        embedded, so a refresh costs O(new messages) instead of O(corpus).
+        Only "individual" documents can be extended: aggregated chunks of
+        existing users would change. Growth beyond 2x rebuilds instead, so
+        trained quantizers (sq8, IVF-PQ) are refit.
+        
+        Args:
+            saved_meta: index_meta.json of the saved index
+            corpus: Current fetch_corpus_info() result
+            corpus_hash: Fingerprint of `corpus`
+            
+        Returns:
+            The extended, loaded FAISS vector store, or None to rebuild
+        """
+        watermark = saved_meta.get("watermark")
+        if self.doc_strategy != "individual" or not watermark or watermark.get("first_id") != corpus["first_id"]:
+            return None
+        indexed = watermark["message_count"]
+        wanted = min(corpus["total"], corpus["limit"])
+        if wanted <= indexed or wanted > 2 * indexed:
+            return None
+        
+        logger.info("Extending saved index with messages %s-%s", indexed, wanted)
+        messages = fetch_all_messages(self.api_url, limit=wanted, skip=indexed)
+        # Guard against pages that shifted since the index was built
+        seen = set(watermark["message_ids"])
+        new_messages = [msg for msg in messages if msg.get("id") not in seen]
+        
+        texts, metadatas = messages_to_records(new_messages, strategy=self.doc_strategy)
+        if texts:
+            vectors = embed_texts_normalized(
+                texts,
+                self.embeddings,
+                batch_size=self.embed_batch_size,
+                concurrency=self.embed_concurrency,
+            )
+            if not extend_faiss_index(self.embeddings, self.index_dir, texts, metadatas, vectors):
+                return None
+        
+        save_index_meta(
+            {
+                **saved_meta,
+                "corpus_hash": corpus_hash,
+                "watermark": {
+                    "first_id": watermark["first_id"],
+                    "message_count": indexed + len(messages),
+                    "message_ids": watermark["message_ids"] + [msg.get("id") for msg in new_messages],
+                },
+            },
+            self.index_dir,
+        )
+        return load_faiss_index(self.embeddings, self.index_dir)
+    
+    def _index_settings(self) -> dict:
+        """Settings an index must have been built with to be reused."""
+        return {
+            "embedding_model": self.embedding_model,
+            "doc_strategy": self.doc_strategy,
+            "index_type": self.index_type,
+        }
     
     def retrieve_context(self, state: AgentState) -> AgentState:
         """
@@ -104,47 +477,152 @@ class RAGNodes:
             state: Current agent state with question
             
         Returns:
-            Updated state with top_docs and relevant_context populated
+            Updated state with top_doc_ids and relevant_context populated
         """
-        if self._vectorstore is None:
-            raise ValueError("Vectorstore not initialized. Run load_and_index first.")
-        
-        question = state["question"]
+        return self._retrieve_context(state)
+    
+    def retrieve_context_batch(self, states: List[AgentState]) -> List[AgentState]:
+        """
+        Run retrieve_context() for several questions, embedding them together.
         
-        # Expand query for counting/enumeration questions (OPTIMIZED: max 2 queries)
-        expanded_queries = self._expand_query(question)
+        All questions are embedded in a single embeddings request instead
+        of one round-trip each; name boosting, query expansion and the
+        semantic cache then run per question as usual.
         
-        # Perform semantic search with all queries
-        all_docs = {}  # Use dict to deduplicate by content
-        for query in expanded_queries:
-            results = semantic_search(self._vectorstore, query, k=self.k)
-            for doc, score in results:
-                content = doc.page_content
-                if content not in all_docs or all_docs[content][1] > score:
-                    all_docs[content] = (doc, score)
+        Args:
+            states: Agent states with questions (load_and_index already run)
+            
+        Returns:
+            The same states, each with top_doc_ids and relevant_context populated
+        """
+        if not states:
+            return states
+        if self._index is None:
+            raise ValueError("Vectorstore not initialized. Run load_and_index first.")
+        question_vecs = embed_queries_normalized(self.embeddings, [state["question"] for state in states])
+        return [self._retrieve_context(state, vec) for state, vec in zip(states, question_vecs)]
+    
+    def _retrieve_context(self, state: AgentState, question_vec: Optional[np.ndarray] = None) -> AgentState:
+        """retrieve_context() with an optional precomputed, normalized question embedding."""
+        # Read the index bundle once: the whole request uses one consistent
+        # index even if clear_cache() or a reload replaces it meanwhile
+        index, embeddings, k = self._index, self.embeddings, self.k
+        if index is None:
+            raise ValueError("Vectorstore not initialized. Run load_and_index first.")
         
-        # Convert back to list and sort by score (OPTIMIZED: limit to k docs only)
-        top_docs = sorted(all_docs.values(), key=lambda x: x[1])[:self.k]
+        question = state["question"]
         
         # Extract potential user names from question for hybrid retrieval
         extracted_names = self._extract_names_from_question(question)
         
-        # If we detected a name, boost results from that user (OPTIMIZED: limited boosting)
-        if extracted_names:
-            logger.info(f"Detected name(s) in question: {extracted_names}")
-            top_docs = self._boost_user_documents(top_docs, extracted_names)
+        # Expand query for counting/enumeration questions (OPTIMIZED: max 2 queries)
+        # The first query is always the question itself
+        expanded_queries = self._expand_query(question, extracted_names)
+        
+        # The extra queries only depend on the question text, so their embedding
+        # request runs on the pool while the question itself is embedded
+        extra_future = None
+        if len(expanded_queries) > 1:
+            extra_future = _SEARCH_POOL.submit(embed_queries_normalized, embeddings, expanded_queries[1:])
+        
+        # Embed the question once: used for the cache lookup and the main search
+        if question_vec is None:
+            question_vec = embed_query_normalized(embeddings, question)
+        
+        cached = self._qcache_lookup(question_vec, extracted_names)
+        if cached is not None:
+            if extra_future is not None:
+                extra_future.cancel()
+            top_doc_ids, context = cached
+            logger.info("Semantic retrieval cache hit (%s documents)", len(top_doc_ids))
+            state["top_doc_ids"] = top_doc_ids
+            state["relevant_context"] = context
+            return state
+        
+        # Run every search in one FAISS call
+        vectors = question_vec[np.newaxis, :]
+        if extra_future is not None:
+            vectors = np.vstack([vectors, extra_future.result()])
+        if index.rerank:
+            # Compressed index: over-fetch candidates, then rescore them exactly
+            scores, ids = batch_search_ids(index.vectorstore, vectors, k=k * RERANK_FACTOR)
+            scores = rerank_scores(index.embeddings_matrix, vectors, ids)
+        else:
+            scores, ids = batch_search_ids(index.vectorstore, vectors, k=k)
         
-        # Format context for LLM (memory-optimized)
-        context = format_retrieved_context(top_docs)
+        # Merge results from all queries: best score per document, top k overall.
+        # Documents are only materialized for the surviving ids.
+        top_ids, top_scores = best_unique_ids(ids, scores, k)
         
-        # Store only essential data to reduce memory
-        state["top_docs"] = top_docs
+        # If we detected a name, boost results from that user (OPTIMIZED: limited boosting)
+        if extracted_names:
+            logger.info("Detected name(s) in question: %s", extracted_names)
+            top_ids, top_scores = self._boost_user_documents(index, top_ids, top_scores, extracted_names, question_vec)
+        
+        # Format context for LLM (memory-optimized): only the top k documents
+        # are read from the docstore
+        context = format_context_from_docstore(index.vectorstore, top_ids)
+        
+        # Store only essential data to reduce memory: the documents themselves
+        # stay in the vectorstore, the state carries (row id, score) pairs
+        top_doc_ids = list(zip(top_ids.tolist(), top_scores.tolist()))
+        self._qcache_store(index, question_vec, extracted_names, top_doc_ids, context)
+        state["top_doc_ids"] = top_doc_ids
         state["relevant_context"] = context
         
-        logger.info(f"Retrieved {len(top_docs)} relevant documents")
+        logger.info("Retrieved %s relevant documents", len(top_doc_ids))
         return state
     
-    def _expand_query(self, question: str) -> List[str]:
+    def _qcache_lookup(self, question_vec: np.ndarray, names: List[str]) -> Optional[Tuple[List, str]]:
+        """
+        Find a cached retrieval for a semantically equivalent question.
+        
+        Scores every cached question embedding with one matrix-vector
+        product. The detected names must match too, since questions about
+        different people can still embed almost identically.
+        
+        Returns:
+            (top_doc_ids, context) on a hit, otherwise None
+        """
+        with self._qcache_lock:
+            if self._qcache_vecs is None or self._qcache_vecs.shape[1] != len(question_vec):
+                return None
+            scores = self._qcache_vecs @ question_vec
+            best = int(np.argmax(scores))
+            payload = self._qcache_payload[best]
+        
+        if payload is None or scores[best] < QUERY_CACHE_THRESHOLD:
+            return None
+        cached_names, top_doc_ids, context = payload
+        if cached_names != tuple(names):
+            return None
+        return top_doc_ids, context
+    
+    def _qcache_store(self, index: LoadedIndex, question_vec: np.ndarray, names: List[str], top_doc_ids: List, context: str):
+        """Write a retrieval result into the semantic cache ring buffer."""
+        if QUERY_CACHE_SIZE <= 0:
+            return
+        with self._qcache_lock:
+            # Retrieved from an index that has since been dropped: don't cache
+            if self._index is not index:
+                return
+            if self._qcache_vecs is None or self._qcache_vecs.shape[1] != len(question_vec):
+                self._qcache_vecs = np.zeros((QUERY_CACHE_SIZE, len(question_vec)), dtype="float32")
+                self._qcache_payload = [None] * QUERY_CACHE_SIZE
+                self._qcache_pos = 0
+            pos = self._qcache_pos
+            self._qcache_vecs[pos] = question_vec
+            self._qcache_payload[pos] = (tuple(names), top_doc_ids, context)
+            self._qcache_pos = (pos + 1) % QUERY_CACHE_SIZE
+    
+    def _qcache_clear(self):
+        """Drop all cached retrievals (they reference the old index's documents)."""
+        with self._qcache_lock:
+            self._qcache_vecs = None
+            self._qcache_payload = [None] * QUERY_CACHE_SIZE
+            self._qcache_pos = 0
+    
+    def _expand_query(self, question: str, names: List[str]) -> List[str]:
         """
         Expand the query for better coverage across different question types.
         
@@ -154,53 +632,13 @@ class RAGNodes:
         - Counting questions: "How many cars does X have?" -> ["original", "X cars"]
         - Who questions: "Who has travel plans?" -> ["original", "travel vacation trip"]
         - What questions with names: "What are X's restaurants?" -> ["original", "X restaurants dining"]
-        """
-        queries = [question]
-        
-        question_lower = question.lower()
-        
-        # Detect question type
-        is_who_question = question_lower.startswith('who ')
-        is_what_question = question_lower.startswith('what ')
-        is_counting = any(keyword in question_lower for keyword in ['how many', 'count', 'number of', 'list all', 'what are all'])
-        
-        # Detect the subject/topic with expanded keywords
-        subject_keywords = {
-            'travel': ['travel', 'trip', 'trips', 'vacation', 'journey', 'visit', 'visiting'],
-            'car': ['car', 'cars', 'vehicle', 'vehicles', 'BMW', 'Mercedes', 'Tesla', 'automobile'],
-            'restaurant': ['restaurant', 'restaurants', 'dining', 'food', 'Italian', 'cuisine', 'eatery'],
-            'hotel': ['hotel', 'hotels', 'accommodation', 'stay', 'staying'],
-        }
         
-        detected_topics = []
-        for topic, keywords in subject_keywords.items():
-            if any(keyword in question_lower for keyword in keywords):
-                detected_topics.append((topic, keywords))
-        
-        # Extract names from question
-        names = self._extract_names_from_question(question)
-        
-        # OPTIMIZED: Add ONE most relevant expanded query based on question type
-        if is_who_question and detected_topics:
-            # For "Who has X?" questions, expand with topic synonyms
-            topic, keywords = detected_topics[0]
-            # Use top 3 most relevant synonyms
-            synonym_query = ' '.join(keywords[:3])
-            queries.append(synonym_query)
-        elif is_counting and names and detected_topics:
-            # For counting with name: "How many cars does X have?"
-            name = names[0]
-            topic = detected_topics[0][0]
-            queries.append(f"{name} {topic}")
-        elif names and detected_topics:
-            # For name-based questions: "What are X's restaurants?"
-            name = names[0]
-            topic = detected_topics[0][0]
-            # Add name + topic keywords
-            topic_keywords = detected_topics[0][1][:2]  # Use top 2 keywords
-            queries.append(f"{name} {' '.join(topic_keywords)}")
-        
-        logger.info(f"Expanded query to {len(queries)} variants: {queries}")
+        Args:
+            question: The user's question
+            names: Names already extracted from the question
+        """
+        queries = list(_cached_expand_query(question, tuple(names)))
+        logger.info("Expanded query to %s variants: %s", len(queries), queries)
         return queries
     
     def _extract_names_from_question(self, question: str) -> List[str]:
@@ -208,103 +646,72 @@ class RAGNodes:
         Extract potential user names from the question.
         
         Enhanced heuristic: looks for capitalized words and common name patterns.
+        Single regex pass over the question using module-level patterns.
         """
-        import re
-        # Look for capitalized words (simple name detection)
-        words = question.split()
-        names = []
-        
-        # Common question words and pronouns to skip
-        skip_words = {
-            'who', 'what', 'when', 'where', 'why', 'how', 'which', 'whose',
-            'i', 'me', 'my', 'mine', 'we', 'us', 'our', 'ours',
-            'you', 'your', 'yours', 'he', 'him', 'his', 'she', 'her', 'hers',
-            'it', 'its', 'they', 'them', 'their', 'theirs',
-            'monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday',
-            'january', 'february', 'march', 'april', 'may', 'june',
-            'july', 'august', 'september', 'october', 'november', 'december'
-        }
-        
-        for word in words:
-            # Remove punctuation and check if it's capitalized
-            clean_word = re.sub(r'[^\w\s]', '', word)
-            if clean_word and len(clean_word) > 1:
-                # Check if first letter is uppercase
-                if clean_word[0].isupper():
-                    # Skip common question words
-                    if clean_word.lower() not in skip_words:
-                        names.append(clean_word)
-        
-        logger.info(f"Extracted potential names from question: {names}")
+        names = list(_cached_extract_names(question))
+        logger.info("Extracted potential names from question: %s", names)
         return names
     
-    def _boost_user_documents(self, top_docs: List[Tuple[Document, float]], names: List[str]) -> List[Tuple[Document, float]]:
+    def _boost_user_documents(self, index: LoadedIndex, top_ids: np.ndarray, top_scores: np.ndarray, names: List[str],
+                              question_vec: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
         """
         Boost documents from specific users by retrieving more of their messages.
         
         OPTIMIZED FOR MEMORY: Limits additional searches and result size.
-        Handles name variations for better matching.
+        Handles name variations for better matching. The name is fuzzy-matched
+        against the distinct member names once, and the user -> row ids
+        inverted index gives their documents. Those rows are scored against
+        the question with one small matrix-vector product, so no extra
+        embedding request or FAISS search is needed.
+        
+        Args:
+            index: Index bundle the request is reading
+            top_ids: Row ids retrieved for the question
+            top_scores: Distances for top_ids
+            names: Names extracted from the question
+            question_vec: L2-normalized question embedding
+            
+        Returns:
+            Tuple of (row ids, distances), at most k, best first
         """
         # OPTIMIZED: Only process first name to reduce memory usage
         if not names:
-            return top_docs
+            return top_ids, top_scores
         
         name = names[0]  # Only boost for the first detected name
         
-        # Get additional documents from the specific user (OPTIMIZED: fetch fewer)
-        enhanced_docs = list(top_docs)
-        
-        # Search for more documents from this user with multiple name variations
-        # For names like "Amira", also try "Amina" or similar
-        filter_query = f"{name} says messages"
-        additional_docs = semantic_search(self._vectorstore, filter_query, k=max(3, self.k // 2))
-        
-        # Add documents that are from the target user and not already in top_docs
-        existing_contents = {doc.page_content for doc, _ in enhanced_docs}
-        for doc, score in additional_docs:
-            doc_user = doc.metadata.get("user_name", "")
-            # Check for name match with fuzzy matching (handles variations)
-            if self._name_matches(name, doc_user) and doc.page_content not in existing_contents:
-                # Boost the score slightly for user-matched documents
-                enhanced_docs.append((doc, score * 0.95))  # Slight boost
-                existing_contents.add(doc.page_content)
-        
-        # Sort by score (lower is better in FAISS distance metric)
-        enhanced_docs.sort(key=lambda x: x[1])
-        
+        # Fuzzy-match the name against the distinct member names
+        # (handles variations like "Amira" vs "Amina")
+        matches = process.extract(
+            name.lower(),
+            index.unique_user_names_lower,
+            scorer=fuzz.partial_ratio,
+            score_cutoff=NAME_MATCH_CUTOFF,
+            limit=None,
+        )
+        if not matches:
+            return top_ids, top_scores
+        candidate_ids = np.concatenate([index.user_to_doc_ids[user_name] for user_name, _, _ in matches])
+        
+        # Documents from the target user not already in top_ids
+        candidate_ids = candidate_ids[~np.isin(candidate_ids, top_ids)]
+        if candidate_ids.size == 0:
+            return top_ids, top_scores
+        
+        # Score the user's documents directly (same distance as FAISS: 1 - cosine)
+        # and keep only their best few
+        boost_k = max(3, self.k // 2)
+        candidate_scores = 1.0 - index.embeddings_matrix[candidate_ids] @ question_vec
+        best = smallest_k(candidate_scores, boost_k)
+        
+        ids = np.concatenate([top_ids, candidate_ids[best]])
+        # Boost the score slightly for user-matched documents
+        scores = np.concatenate([top_scores, candidate_scores[best] * 0.95])
+        
+        # Keep the k best by score (lower is better in FAISS distance metric)
         # OPTIMIZED: Return only k docs (not k*1.5) to save memory
-        return enhanced_docs[:self.k]
-    
-    def _name_matches(self, query_name: str, doc_user_name: str) -> bool:
-        """
-        Check if a query name matches a document user name.
-        
-        Handles variations like:
-        - Exact match: "Layla" matches "Layla Kawaguchi"
-        - Partial match: "Amira" might match "Amina" (if close enough)
-        - Case insensitive
-        """
-        query_lower = query_name.lower()
-        doc_lower = doc_user_name.lower()
-        
-        # Direct substring match
-        if query_lower in doc_lower:
-            return True
-        
-        # Check if the query name is similar to any part of the doc name
-        # Simple similarity: if 80%+ of characters match in order
-        doc_parts = doc_lower.split()
-        for part in doc_parts:
-            if len(query_lower) >= 3 and len(part) >= 3:
-                # Calculate simple character overlap
-                matching_chars = sum(1 for i, c in enumerate(query_lower) 
-                                   if i < len(part) and c == part[i])
-                similarity = matching_chars / max(len(query_lower), len(part))
-                if similarity >= 0.75:  # 75% similarity threshold
-                    logger.info(f"Fuzzy name match: '{query_name}' ~= '{part}' in '{doc_user_name}'")
-                    return True
-        
-        return False
+        order = smallest_k(scores, self.k)
+        return ids[order], scores[order]
     
     def generate_answer(self, state: AgentState) -> AgentState:
         """
@@ -312,6 +719,10 @@ class RAGNodes:
         
         OPTIMIZED FOR MEMORY: Cleans up state after generation.
         
+        The answer is streamed from the LLM; if state["on_token"] is set it
+        is called with each chunk as it arrives, so callers can show the
+        answer before generation finishes.
+        
         Args:
             state: Current agent state with question and relevant_context
             
@@ -321,37 +732,16 @@ class RAGNodes:
         question = state["question"]
         context = state["relevant_context"]
         
-        system_prompt = """You are a helpful assistant that answers questions about member data.
-Use ONLY the provided context (member messages) to answer questions.
-The context includes messages retrieved via semantic search - they are the most relevant to the question.
-
-IMPORTANT INSTRUCTIONS:
-- Be specific and cite the member's name when providing information.
-- For date/time questions, extract specific dates, days of the week, or time periods mentioned in messages. If a timestamp is provided, use it to give context like "in March 2024" or specific dates.
-- For counting questions (how many, count, list), count ALL unique items mentioned across ALL messages provided.
-- When asked "how many X does Y have?", interpret this as "how many X are mentioned by/about Y?"
-  Examples: "how many cars" = count all car types/brands mentioned (BMW, Tesla, Mercedes, etc.)
-- For aggregation questions like "Who has travel plans?" or "Who likes X?", review EVERY message in the context and list ALL members mentioned. Be exhaustive.
-- Some messages are aggregated (grouped together) and some are individual - use all of them.
-- If you see the same information repeated across multiple messages, count unique items only once.
-- When listing people or items, be thorough and check all messages before responding.
-- For name-based queries, consider common name variations (e.g., Amira might be Amina, or vice versa) - if you find a similar name, mention it.
-- When counting or listing, show your work by mentioning what you found to be transparent.
-- If truly no relevant information exists in the context, say so honestly."""
-
-        user_prompt = f"""Question: {question}
-
-Context (Most Relevant Member Messages):
-{context}
-
-Please answer the question based on the context provided above. Be concise and accurate."""
-
-        response = self.llm.invoke([
-            SystemMessage(content=system_prompt),
-            HumanMessage(content=user_prompt)
-        ])
+        on_token = state.get("on_token")
         
-        answer = response.content.strip()
+        chunks = []
+        for chunk in self.llm.stream(self.build_answer_messages(question, context)):
+            if chunk.content:
+                chunks.append(chunk.content)
+                if on_token is not None:
+                    on_token(chunk.content)
+        
+        answer = "".join(chunks).strip()
         state["answer"] = answer
         
         # OPTIMIZED: Don't store full conversation history to save memory
@@ -362,14 +752,35 @@ Please answer the question based on the context provided above. Be concise and a
         ]
         
         # OPTIMIZED: Clear large objects from state to free memory
-        state["top_docs"] = []  # Clear document references
+        state["top_doc_ids"] = []  # Clear document references
         state["relevant_context"] = ""  # Clear context string
         
-        logger.info(f"Generated answer: {answer[:100]}...")
+        if logger.isEnabledFor(logging.INFO):
+            logger.info("Generated answer: %s...", answer[:100])
         return state
     
+    def build_answer_messages(self, question: str, context: str) -> List:
+        """
+        Build the LLM messages for answering a question.
+        
+        The invariant system prompt always comes first so the shared prefix
+        is cacheable; the per-request context and question follow it.
+        """
+        return [
+            SystemMessage(content=SYSTEM_PROMPT),
+            HumanMessage(content=f"Context (Most Relevant Member Messages):\n{context}"),
+            HumanMessage(content=f"Question: {question}\n\nPlease answer the question based on the context provided above. Be concise and accurate."),
+        ]
+    
     def clear_cache(self):
-        """Clear the vectorstore cache to force rebuild."""
-        self._vectorstore = None
+        """
+        Drop the in-memory vectorstore.
+        
+        The next request reloads the saved index, or rebuilds it if the
+        upstream corpus fingerprint has changed.
+        """
+        with self._qcache_lock:
+            self._index = None
+        self._qcache_clear()
         logger.info("Vectorstore cache cleared")
 
@@ -2,9 +2,8 @@
 State schema for the QnA LangGraph agent with RAG support.
 """
 
-from typing import TypedDict, List, Dict, Annotated, Tuple
+from typing import TypedDict, List, Dict, Annotated, Tuple, Optional, Callable
 from langgraph.graph.message import add_messages
-from langchain_core.documents import Document
 
 
 class AgentState(TypedDict):
@@ -14,13 +13,15 @@ class AgentState(TypedDict):
     Attributes:
         messages: Conversation history (uses add_messages for automatic merging)
         question: Current question being processed
-        top_docs: Top retrieved documents with similarity scores
+        top_doc_ids: FAISS row ids of the retrieved documents with distance scores
         relevant_context: Relevant member messages extracted via semantic search
         answer: Generated answer for the question
+        on_token: Optional callback receiving answer text as it is generated
     """
     messages: Annotated[List, add_messages]  # Conversation history
     question: str  # Current question
-    top_docs: List[Tuple[Document, float]]  # Retrieved documents with scores
+    top_doc_ids: List[Tuple[int, float]]  # Retrieved row ids with scores (documents stay in the vectorstore)
     relevant_context: str  # Context built from retrieved documents
     answer: str  # Generated answer
+    on_token: Optional[Callable[[str], None]]  # Streaming callback (None = don't stream)
 
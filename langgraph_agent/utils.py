@@ -5,17 +5,35 @@ Includes API calls, FAISS indexing, and semantic search functions.
 """
 
 import os
+import json
+import math
+import asyncio
+import hashlib
+import uuid
+import pickle
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import logging
+from operator import itemgetter
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Dict, Optional, Tuple
 from pathlib import Path
-from dotenv import load_dotenv
 
+import faiss
+import numpy as np
+import pandas as pd
 from langchain_core.documents import Document
 from langchain_openai import OpenAIEmbeddings
+from langchain_community.docstore.in_memory import InMemoryDocstore
 from langchain_community.vectorstores import FAISS
+from langchain_community.vectorstores.utils import DistanceStrategy
 
-load_dotenv()
+from langgraph_agent.env import load_env
+from langgraph_agent.docstore import DOCSTORE_FILE, JsonlDocstore, save_docstore_jsonl
+
+load_env()
 
 logger = logging.getLogger(__name__)
 
@@ -26,16 +44,136 @@ MESSAGES_API_URL = os.getenv(
 )
 MESSAGES_API_KEY = os.getenv("MESSAGES_API_KEY")
 
+# Default number of messages an index build fetches
+MAX_MESSAGES_LIMIT = int(os.getenv("MAX_MESSAGES_LIMIT", "500"))
+
 
-def fetch_all_messages(api_url: str = MESSAGES_API_URL, limit: int = None) -> List[Dict]:
+def _create_http_session() -> requests.Session:
+    """
+    Create the HTTP session used for Messages API calls.
+    
+    Keep-alive connections are pooled and reused across calls (no new TLS
+    handshake per request), and transient 5xx responses are retried with
+    backoff. After the last retry the response is returned as-is, so
+    callers still see the status via raise_for_status().
+    """
+    session = requests.Session()
+    retry = Retry(total=3, backoff_factor=0.3, status_forcelist=[502, 503, 504], raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=retry)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers["Accept-Encoding"] = "gzip"
+    if MESSAGES_API_KEY:
+        session.headers["Authorization"] = f"Bearer {MESSAGES_API_KEY}"
+    return session
+
+
+_http_session = _create_http_session()
+
+# Messages are fetched in pages of this size, with up to
+# MESSAGES_FETCH_CONCURRENCY page requests in flight
+MESSAGES_PAGE_SIZE = int(os.getenv("MESSAGES_PAGE_SIZE", "500"))
+MESSAGES_FETCH_CONCURRENCY = int(os.getenv("MESSAGES_FETCH_CONCURRENCY", "8"))
+
+# FAISS index types supported by build_faiss_index
+INDEX_TYPES = ("flat", "fp16", "sq8", "hnsw", "ivfpq")
+
+# Scalar-quantized exact-scan indexes: 2x / 4x fewer bytes per vector than flat
+SCALAR_QUANTIZER_TYPES = {
+    "fp16": faiss.ScalarQuantizer.QT_fp16,
+    "sq8": faiss.ScalarQuantizer.QT_8bit,
+}
+
+# Recall gate for "fp16"/"sq8": mean top-k Jaccard overlap with exact search,
+# over a sample of the corpus vectors used as queries, must reach this or the
+# index falls back to "flat"
+SQ_RECALL_MIN = float(os.getenv("SQ_RECALL_MIN", "0.95"))
+SQ_RECALL_K = 5
+SQ_RECALL_SAMPLE = 200
+
+# Search-time parameters for approximate indexes
+HNSW_M = 32
+HNSW_EF_SEARCH = 64
+IVF_NPROBE = int(os.getenv("IVF_NPROBE", "16"))
+
+# IVF-PQ layout: nlist = IVF_NLIST_FACTOR * sqrt(N) coarse clusters, and
+# PQ codes of up to 32 sub-quantizers x 8 bits (32 bytes per vector)
+IVF_NLIST_FACTOR = 4
+PQ_MAX_SUBQUANTIZERS = 32
+PQ_NBITS = 8
+
+# Below this many vectors IVF-PQ training dominates and recall suffers,
+# so "ivfpq" builds an HNSW index instead
+IVFPQ_MIN_VECTORS = int(os.getenv("IVFPQ_MIN_VECTORS", "10000"))
+
+# Read saved indexes via mmap so vector data is served from the OS page cache
+# (IO_FLAG_MMAP_IFC covers flat/HNSW storage; older FAISS only maps IVF lists)
+INDEX_MMAP_FLAGS = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY
+
+# Serve searches from a GPU copy of the index when faiss-gpu and a GPU are
+# available (FAISS_USE_GPU=0 disables); the CPU index is used otherwise
+FAISS_USE_GPU = os.getenv("FAISS_USE_GPU", "1").lower() not in ("0", "false", "no")
+FAISS_GPU_DEVICE = int(os.getenv("FAISS_GPU_DEVICE", "0"))
+_gpu_resources = None
+
+# Metadata saved next to the index, used to decide whether it can be reused
+INDEX_META_FILE = "index_meta.json"
+
+# Exact float32 document vectors saved next to compressed indexes (sq8, fp16,
+# ivfpq; memory-mapped on load). Those retrieve RERANK_FACTOR * k candidates
+# and rerank them with these vectors. flat/hnsw store the exact vectors
+# already, so nothing extra is written for them.
+EMBEDDINGS_FILE = "embeddings.npy"
+RERANK_FACTOR = int(os.getenv("RERANK_FACTOR", "4"))
+
+# Documents whose embeddings have cosine similarity >= this with an earlier
+# document are dropped before indexing (set above 1 to disable)
+DEDUP_THRESHOLD = float(os.getenv("DEDUP_THRESHOLD", "0.97"))
+
+# Embedding requests issued while building an index: texts per request and
+# max requests in flight (bounded to stay within OpenAI rate limits).
+# OpenAI accepts at most 2048 inputs per embeddings request.
+OPENAI_MAX_EMBED_INPUTS = 2048
+EMBED_BATCH_SIZE = min(int(os.getenv("EMBED_BATCH_SIZE", "2048")), OPENAI_MAX_EMBED_INPUTS)
+EMBED_CONCURRENCY = int(os.getenv("EMBED_CONCURRENCY", "8"))
+
+
+def _fetch_messages_page(api_url: str, skip: int, limit: int) -> Dict:
+    """Fetch one page of messages ({skip, limit}) and return the decoded JSON."""
+    # Pooled session: reuses the connection and sends the API key if set
+    response = _http_session.get(
+        api_url,
+        params={"skip": skip, "limit": limit},
+        timeout=30
+    )
+    response.raise_for_status()
+    # orjson parses the raw bytes directly (faster than response.json())
+    return orjson.loads(response.content)
+
+
+def fetch_all_messages(
+    api_url: str = MESSAGES_API_URL,
+    limit: int = None,
+    page_size: int = MESSAGES_PAGE_SIZE,
+    concurrency: int = MESSAGES_FETCH_CONCURRENCY,
+    skip: int = 0,
+) -> List[Dict]:
     """
     Fetch all messages from the API.
     
     OPTIMIZED FOR MEMORY: Uses conservative default limit.
     
+    The first page also reports the corpus total; the remaining pages are
+    then requested concurrently, so wall time is roughly two page latencies
+    instead of one (slow) response for the whole corpus.
+    
     Args:
         api_url: URL of the messages API endpoint
         limit: Maximum number of messages to fetch
+        page_size: Messages per page request
+        concurrency: Maximum page requests in flight
+        skip: Number of leading messages to skip (e.g. those already indexed);
+              `limit` still counts from the first message
         
     Returns:
         List of message dictionaries
@@ -46,210 +184,740 @@ def fetch_all_messages(api_url: str = MESSAGES_API_URL, limit: int = None) -> Li
     try:
         # OPTIMIZED: Use environment variable for limit, default to 500 for memory optimization
         if limit is None:
-            limit = int(os.getenv("MAX_MESSAGES_LIMIT", "500"))
+            limit = MAX_MESSAGES_LIMIT
         
-        logger.info(f"Fetching messages from {api_url} (limit={limit})")
+        logger.info("Fetching messages from %s (skip=%s, limit=%s)", api_url, skip, limit)
+        if skip >= limit:
+            return []
         
-        # Prepare headers with authentication if API key is available
-        headers = {}
-        if MESSAGES_API_KEY:
-            headers["Authorization"] = f"Bearer {MESSAGES_API_KEY}"
-        
-        response = requests.get(
-            api_url,
-            params={"skip": 0, "limit": limit},
-            headers=headers,
-            timeout=30
-        )
-        response.raise_for_status()
-        data = response.json()
+        data = _fetch_messages_page(api_url, skip, min(page_size, limit - skip))
         messages = data.get("items", [])
-        logger.info(f"Fetched {len(messages)} messages from API")
+        wanted = min(limit, data.get("total", skip + len(messages)))
+        
+        skips = range(skip + len(messages), wanted, page_size) if messages else range(0)
+        if skips:
+            with ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(skips)))) as pool:
+                pages = pool.map(
+                    lambda skip: _fetch_messages_page(api_url, skip, min(page_size, wanted - skip)),
+                    skips,
+                )
+                for page in pages:
+                    messages.extend(page.get("items", []))
+        
+        logger.info("Fetched %s messages from API", len(messages))
         return messages
     except Exception as e:
-        logger.error(f"Error fetching messages: {e}")
+        logger.error("Error fetching messages: %s", e)
         raise
 
 
-def messages_to_documents(messages: List[Dict], strategy: str = "individual") -> List[Document]:
+def fetch_corpus_info(api_url: str = MESSAGES_API_URL, limit: int = None) -> Dict:
     """
-    Convert API messages to LangChain Documents for FAISS indexing.
+    Describe the upstream message corpus with a single one-message request.
+    
+    Args:
+        api_url: URL of the messages API endpoint
+        limit: Maximum number of messages an index build fetches
+        
+    Returns:
+        Dict with the total message count, the first message id and the limit
+        
+    Raises:
+        Exception: If API request fails
+    """
+    if limit is None:
+        limit = MAX_MESSAGES_LIMIT
+    
+    response = _http_session.get(
+        api_url,
+        params={"skip": 0, "limit": 1},
+        timeout=10
+    )
+    response.raise_for_status()
+    data = orjson.loads(response.content)
+    items = data.get("items", [])
+    
+    return {
+        "total": data.get("total", len(items)),
+        "first_id": items[0].get("id") if items else None,
+        "limit": limit,
+    }
+
+
+def corpus_fingerprint(corpus_info: Dict) -> str:
+    """
+    Hex SHA-256 of a fetch_corpus_info() result.
+    
+    Hashes the total message count, the first message id and the fetch
+    limit, so an unchanged corpus can be detected without downloading or
+    embedding it.
+    """
+    return hashlib.sha256(json.dumps(corpus_info, sort_keys=True).encode()).hexdigest()
+
+
+def messages_to_records(messages: List[Dict], strategy: str = "individual") -> Tuple[List[str], List[Dict]]:
+    """
+    Convert API messages to parallel (texts, metadatas) lists for indexing.
     
     Strategies:
     - "individual": Each message becomes a separate document
     - "aggregated": Group all messages by user with chunking and overlap
     - "hybrid": Create both individual and aggregated documents
     
+    The index build embeds and deduplicates on these plain lists, so
+    Document objects are only created for the rows that are kept.
+    
     Args:
         messages: List of raw message dictionaries from API
         strategy: Document creation strategy ("individual", "aggregated", or "hybrid")
         
     Returns:
-        List of Document objects
+        Tuple of (page contents, metadata dicts), same length and order
     """
     if strategy == "individual":
-        return _create_individual_documents(messages)
+        return _create_individual_records(messages)
     elif strategy == "aggregated":
-        return _create_aggregated_documents(messages)
+        return _create_aggregated_records(messages)
     elif strategy == "hybrid":
-        individual = _create_individual_documents(messages)
-        aggregated = _create_aggregated_documents(messages)
-        logger.info(f"Created {len(individual)} individual + {len(aggregated)} aggregated = {len(individual) + len(aggregated)} total documents")
-        return individual + aggregated
+        texts, metadatas = _create_individual_records(messages)
+        aggregated_texts, aggregated_metadatas = _create_aggregated_records(messages)
+        logger.info("Created %s individual + %s aggregated = %s total documents",
+                    len(texts), len(aggregated_texts), len(texts) + len(aggregated_texts))
+        return texts + aggregated_texts, metadatas + aggregated_metadatas
     else:
         raise ValueError(f"Unknown strategy: {strategy}")
 
 
-def _create_individual_documents(messages: List[Dict]) -> List[Document]:
-    """Create one document per message."""
-    documents = []
-    
-    for msg in messages:
-        # Create document content with member context
-        user_name = msg.get("user_name", "Unknown")
-        message_text = msg.get("message", "")
-        timestamp = msg.get("timestamp", "")
-        
-        # Enriched content for better semantic search
-        content = f"{user_name} says: {message_text}"
-        
-        # Add metadata for filtering and citation
-        metadata = {
+_MESSAGE_FIELDS = itemgetter("user_name", "message", "timestamp", "user_id")
+
+
+def _message_fields(msg: Dict) -> Tuple:
+    """(user_name, message, timestamp, user_id) of a message, with defaults for missing keys."""
+    try:
+        # Fast path: one C-level lookup for all four fields
+        return _MESSAGE_FIELDS(msg)
+    except KeyError:
+        return (msg.get("user_name", "Unknown"), msg.get("message", ""),
+                msg.get("timestamp", ""), msg.get("user_id", ""))
+
+
+def _create_individual_records(messages: List[Dict]) -> Tuple[List[str], List[Dict]]:
+    """Create one (text, metadata) record per message."""
+    fields = list(map(_message_fields, messages))
+    # Enriched content ("<user> says: <message>") for better semantic search,
+    # plus metadata for filtering and citation
+    texts = ["%s says: %s" % (user_name, message_text) for user_name, message_text, _, _ in fields]
+    metadatas = [
+        {
             "user_name": user_name,
-            "user_id": msg.get("user_id", ""),
+            "user_id": user_id,
             "timestamp": timestamp,
             "message": message_text,
             "doc_type": "individual",
         }
-        
-        documents.append(Document(page_content=content, metadata=metadata))
+        for user_name, message_text, timestamp, user_id in fields
+    ]
     
-    logger.info(f"Converted {len(documents)} messages to individual documents")
-    return documents
+    logger.info("Converted %s messages to individual documents", len(texts))
+    return texts, metadatas
 
 
-def _create_aggregated_documents(messages: List[Dict]) -> List[Document]:
+def _create_aggregated_records(messages: List[Dict]) -> Tuple[List[str], List[Dict]]:
     """
-    Create aggregated documents per user with chunking and overlap.
+    Create aggregated (text, metadata) records per user with chunking and overlap.
     
     This helps answer questions that require information from multiple messages,
     like "How many cars does X have?" by ensuring all of a user's messages
     can be retrieved together.
+    
+    Grouping and the per-user chronological sort run as one vectorized
+    pandas sort; only the chunk assembly is a Python loop.
     """
-    from collections import defaultdict
-    
-    # Group messages by user
-    user_messages = defaultdict(list)
-    for msg in messages:
-        user_name = msg.get("user_name", "Unknown")
-        user_messages[user_name].append(msg)
-    
-    documents = []
-    chunk_size = 3  # Number of messages per chunk
-    overlap = 1     # Number of overlapping messages between chunks
-    
-    for user_name, msgs in user_messages.items():
-        if not msgs:
-            continue
-        
-        # Sort by timestamp for chronological order
-        msgs_sorted = sorted(msgs, key=lambda x: x.get("timestamp", ""))
-        
-        # Create overlapping chunks
-        for i in range(0, len(msgs_sorted), chunk_size - overlap):
-            chunk_msgs = msgs_sorted[i:i + chunk_size]
-            
-            # Combine messages in this chunk
-            combined_messages = []
-            timestamps = []
-            for msg in chunk_msgs:
-                message_text = msg.get("message", "")
-                timestamp = msg.get("timestamp", "")
-                combined_messages.append(f"- {message_text}")
-                timestamps.append(timestamp)
-            
-            # Create enriched content
-            content = f"{user_name}'s messages:\n" + "\n".join(combined_messages)
-            
-            # Metadata
-            metadata = {
+    # Chunks of 3 messages overlapping by 1, so each window advances by 2.
+    # The window is hand-unrolled below for these sizes.
+    
+    if not messages:
+        logger.info("Created 0 aggregated documents from 0 users")
+        return [], []
+    
+    # object dtype keeps field values (including None) exactly as the API sent them
+    table = pd.DataFrame(
+        list(map(_message_fields, messages)),
+        columns=["user_name", "message", "timestamp", "user_id"],
+        dtype=object,
+    )
+    # Group number = order of each user's first message
+    table["group"] = pd.factorize(table["user_name"], use_na_sentinel=False)[0]
+    # Each user's name and user_id come from their first message
+    users = table.drop_duplicates("group")
+    
+    # Sort by user, then by timestamp for chronological order (stable, so
+    # equal timestamps keep their original order). The API usually returns
+    # messages chronologically already; then a stable integer sort on the
+    # user number alone gives the same order without comparing timestamp strings.
+    if table["timestamp"].is_monotonic_increasing:
+        ordered = table.iloc[np.argsort(table["group"].to_numpy(), kind="stable")]
+    else:
+        ordered = table.sort_values(["group", "timestamp"], kind="stable")
+    lines = ("- " + ordered["message"].map(str)).tolist()
+    timestamps = ordered["timestamp"].tolist()
+    group_ends = np.cumsum(np.bincount(table["group"].to_numpy()))
+    
+    texts, metadatas = [], []
+    start = 0
+    for user_name, user_id, end in zip(users["user_name"], users["user_id"], group_ends.tolist()):
+        header = f"{user_name}'s messages:\n"
+        
+        # OPTIMIZED: Full 3-message windows, without slicing or min() per chunk
+        for i in range(start, end - 2, 2):
+            first_ts = timestamps[i]
+            texts.append("%s%s\n%s\n%s" % (header, lines[i], lines[i + 1], lines[i + 2]))
+            metadatas.append({
                 "user_name": user_name,
-                "user_id": msgs[0].get("user_id", ""),
-                "timestamp": timestamps[0] if timestamps else "",
-                "timestamp_range": f"{timestamps[0]} to {timestamps[-1]}" if len(timestamps) > 1 else timestamps[0] if timestamps else "",
-                "message_count": len(chunk_msgs),
+                "user_id": user_id,
+                "timestamp": first_ts,
+                "timestamp_range": f"{first_ts} to {timestamps[i + 2]}",
+                "message_count": 3,
                 "doc_type": "aggregated",
-            }
-            
-            documents.append(Document(page_content=content, metadata=metadata))
+            })
+        
+        # Last window: the final 2 messages if the user has an even count,
+        # otherwise the final message alone
+        if (end - start) % 2 == 0:
+            first_ts = timestamps[end - 2]
+            texts.append("%s%s\n%s" % (header, lines[end - 2], lines[end - 1]))
+            timestamp_range, message_count = f"{first_ts} to {timestamps[end - 1]}", 2
+        else:
+            first_ts = timestamps[end - 1]
+            texts.append(header + lines[end - 1])
+            timestamp_range, message_count = first_ts, 1
+        metadatas.append({
+            "user_name": user_name,
+            "user_id": user_id,
+            "timestamp": first_ts,
+            "timestamp_range": timestamp_range,
+            "message_count": message_count,
+            "doc_type": "aggregated",
+        })
+        start = end
+    
+    logger.info("Created %s aggregated documents from %s users", len(texts), len(users))
+    return texts, metadatas
+
+
+def embed_documents_concurrently(
+    embeddings: OpenAIEmbeddings,
+    texts: List[str],
+    batch_size: int = EMBED_BATCH_SIZE,
+    concurrency: int = EMBED_CONCURRENCY,
+) -> List[List[float]]:
+    """
+    Embed texts in batches, with up to `concurrency` batches in flight.
+    
+    Index builds are dominated by embedding round-trips; overlapping them
+    cuts build time roughly by the concurrency factor. Must be called from
+    a thread without a running event loop (index builds run on the
+    executor); otherwise the batches are embedded one after another.
+    
+    Args:
+        embeddings: Embeddings model (must support aembed_documents)
+        texts: Texts to embed
+        batch_size: Number of texts per embedding request
+        concurrency: Maximum number of concurrent embedding requests
+        
+    Returns:
+        Embedding vectors, in the same order as texts
+    """
+    batches = [texts[i:i + batch_size] for i in range(0, len(texts), batch_size)]
+    
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        pass
+    else:
+        logger.info("Event loop already running, embedding batches sequentially")
+        return [vector for batch in batches for vector in embeddings.embed_documents(batch)]
+    
+    async def _embed_all() -> List[List[List[float]]]:
+        semaphore = asyncio.Semaphore(concurrency)
+        
+        async def _embed(batch: List[str]) -> List[List[float]]:
+            async with semaphore:
+                return await embeddings.aembed_documents(batch)
+        
+        return await asyncio.gather(*(_embed(batch) for batch in batches))
     
-    logger.info(f"Created {len(documents)} aggregated documents from {len(user_messages)} users")
-    return documents
+    logger.info("Embedding %s texts in %s batches (%s concurrent)", len(texts), len(batches), concurrency)
+    results = asyncio.run(_embed_all())
+    return [vector for batch in results for vector in batch]
+
+
+def deduplicate_vectors(vectors: np.ndarray, threshold: float = DEDUP_THRESHOLD) -> List[int]:
+    """
+    Find the rows that survive near-duplicate removal.
+    
+    Each vector's nearest neighbors are found with an exact inner-product
+    search over the set itself; pairs at or above the threshold are merged
+    with union-find, and only the first row of each cluster is kept.
+    
+    Args:
+        vectors: L2-normalized float32 embeddings, shape (N, d)
+        threshold: Cosine similarity at which two rows count as duplicates
+        
+    Returns:
+        Ascending row indices to keep
+    """
+    n = len(vectors)
+    if n < 2 or threshold > 1.0:
+        return list(range(n))
+    
+    index = faiss.IndexFlatIP(vectors.shape[1])
+    index.add(vectors)
+    # Self plus neighbors; k=3 so exact duplicates can't hide the self match
+    scores, neighbors = index.search(vectors, min(3, n))
+    
+    parent = list(range(n))
+    
+    def find(i: int) -> int:
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+    
+    for i in range(n):
+        for score, j in zip(scores[i], neighbors[i]):
+            if j < 0 or j == i or score < threshold:
+                continue
+            root_i, root_j = find(i), find(int(j))
+            if root_i != root_j:
+                # The smaller index survives, so the first occurrence is kept
+                parent[max(root_i, root_j)] = min(root_i, root_j)
+    
+    keep = [i for i in range(n) if find(i) == i]
+    if len(keep) < n:
+        logger.info("Dropped %s near-duplicate documents (cosine >= %s)", n - len(keep), threshold)
+    return keep
 
 
 def build_faiss_index(
     documents: List[Document],
     embeddings: OpenAIEmbeddings,
+    index_type: str = "flat",
+    embed_batch_size: int = EMBED_BATCH_SIZE,
+    embed_concurrency: int = EMBED_CONCURRENCY,
+    precomputed_vecs: Optional[np.ndarray] = None,
 ) -> FAISS:
     """
     Build a FAISS vector store from documents.
     
+    Index types:
+    - "flat": Exact search (IndexFlatIP, best for small corpora)
+    - "fp16": Exhaustive scan over half-precision vectors (half the memory
+      bandwidth of "flat", near-identical recall)
+    - "sq8": Exhaustive scan over 8-bit scalar-quantized vectors (a quarter
+      of the bandwidth, small recall loss)
+    - "hnsw": HNSW graph, log-N search, no training
+    - "ivfpq": Inverted file + product quantization, smallest memory footprint.
+      Falls back to "hnsw" below IVFPQ_MIN_VECTORS (default 10k) documents.
+    
+    All index types use inner product on L2-normalized vectors (cosine),
+    so ranking is a single dot product per vector. Documents are embedded
+    with concurrent batched requests.
+    
     Args:
         documents: List of Document objects
         embeddings: OpenAI embeddings model
+        index_type: FAISS index type, one of INDEX_TYPES (see above)
+        embed_batch_size: Number of documents per embedding request
+        embed_concurrency: Maximum number of concurrent embedding requests
+        precomputed_vecs: Embeddings of the documents, shape (N, d), to skip
+                          the embedding step (e.g. after deduplicate_vectors)
         
     Returns:
         FAISS vector store
     """
-    logger.info(f"Building FAISS index from {len(documents)} documents...")
-    vectorstore = FAISS.from_documents(documents, embeddings)
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown index type: {index_type}")
+    
+    logger.info("Building '%s' FAISS index from %s documents...", index_type, len(documents))
+    
+    if precomputed_vecs is None:
+        vectors = embed_texts_normalized(
+            [doc.page_content for doc in documents], embeddings,
+            batch_size=embed_batch_size, concurrency=embed_concurrency,
+        )
+    else:
+        vectors = np.ascontiguousarray(precomputed_vecs, dtype="float32")
+        faiss.normalize_L2(vectors)
+    
+    index = _create_index(index_type, vectors)
+    index.add(vectors)
+    _configure_search_params(index)
+    
+    if index_type in SCALAR_QUANTIZER_TYPES:
+        recall = _topk_jaccard_vs_exact(index, vectors)
+        if recall < SQ_RECALL_MIN:
+            logger.warning("'%s' top-%s overlap with exact search is %.3f (< %s), using 'flat' instead",
+                           index_type, SQ_RECALL_K, recall, SQ_RECALL_MIN)
+            index = faiss.IndexFlatIP(vectors.shape[1])
+            index.add(vectors)
+        else:
+            logger.info("'%s' top-%s overlap with exact search: %.3f", index_type, SQ_RECALL_K, recall)
+    
+    ids = [str(uuid.uuid4()) for _ in documents]
+    vectorstore = FAISS(
+        embedding_function=embeddings,
+        index=index,
+        docstore=InMemoryDocstore(dict(zip(ids, documents))),
+        index_to_docstore_id=dict(enumerate(ids)),
+        distance_strategy=DistanceStrategy.MAX_INNER_PRODUCT,
+    )
+    
     logger.info("FAISS index built successfully")
     return vectorstore
 
 
-def save_faiss_index(vectorstore: FAISS, index_dir: str = "./faiss_index"):
+def _topk_jaccard_vs_exact(
+    index: faiss.Index,
+    vectors: np.ndarray,
+    k: int = SQ_RECALL_K,
+    sample: int = SQ_RECALL_SAMPLE,
+) -> float:
+    """
+    Mean Jaccard overlap between an index's top-k and exact top-k results.
+    
+    A random sample of the indexed vectors serves as queries; the exact
+    results come from a temporary IndexFlatIP over the same vectors.
+    
+    Args:
+        index: Populated index to check
+        vectors: The L2-normalized vectors added to it, shape (N, d)
+        k: Result depth compared
+        sample: Number of query vectors
+        
+    Returns:
+        Mean |A ∩ B| / |A ∪ B| over the sampled queries (1.0 = identical)
+    """
+    n, d = vectors.shape
+    k = min(k, n)
+    if k == 0:
+        return 1.0
+    rng = np.random.default_rng(0)
+    queries = vectors[rng.choice(n, size=min(sample, n), replace=False)]
+    
+    exact = faiss.IndexFlatIP(d)
+    exact.add(vectors)
+    _, exact_ids = exact.search(queries, k)
+    _, approx_ids = index.search(queries, k)
+    
+    overlaps = [
+        len(set(a) & set(b)) / len(set(a) | set(b))
+        for a, b in zip(exact_ids.tolist(), approx_ids.tolist())
+    ]
+    return float(np.mean(overlaps))
+
+
+def embed_texts_normalized(
+    texts: List[str],
+    embeddings: OpenAIEmbeddings,
+    batch_size: int = EMBED_BATCH_SIZE,
+    concurrency: int = EMBED_CONCURRENCY,
+) -> np.ndarray:
+    """
+    Embed texts (concurrent batches) and L2-normalize the vectors.
+    
+    Returns:
+        float32 array of shape (N, d)
+    """
+    embedded = embed_documents_concurrently(embeddings, texts, batch_size=batch_size, concurrency=concurrency)
+    vectors = np.asarray(embedded, dtype="float32")
+    faiss.normalize_L2(vectors)
+    return vectors
+
+
+def _create_index(index_type: str, vectors: np.ndarray) -> faiss.Index:
+    """
+    Create (and train, if needed) an inner-product FAISS index.
+    
+    Args:
+        index_type: One of INDEX_TYPES
+        vectors: L2-normalized float32 embeddings, shape (N, d)
+        
+    Returns:
+        Empty FAISS index ready for add()
+    """
+    n, d = vectors.shape
+    
+    if index_type == "flat":
+        return faiss.IndexFlatIP(d)
+    
+    if index_type in SCALAR_QUANTIZER_TYPES:
+        index = faiss.IndexScalarQuantizer(d, SCALAR_QUANTIZER_TYPES[index_type], faiss.METRIC_INNER_PRODUCT)
+        # Learns per-dimension ranges for 8-bit codes (no-op for fp16)
+        index.train(vectors)
+        return index
+    
+    if index_type == "ivfpq":
+        nlist = max(1, int(IVF_NLIST_FACTOR * math.sqrt(n)))
+        # k-means needs enough points per centroid, and 8-bit PQ needs 256 per codebook
+        min_train = max(2 ** PQ_NBITS, 39 * nlist, IVFPQ_MIN_VECTORS)
+        if n >= min_train:
+            # Largest sub-quantizer count <= PQ_MAX_SUBQUANTIZERS that divides the dimension
+            m = next(m for m in range(min(PQ_MAX_SUBQUANTIZERS, d), 0, -1) if d % m == 0)
+            index = faiss.index_factory(d, f"IVF{nlist},PQ{m}x{PQ_NBITS}", faiss.METRIC_INNER_PRODUCT)
+            index.train(vectors)
+            return index
+        logger.info("Only %s vectors (IVF-PQ needs %s), using HNSW instead", n, min_train)
+    
+    return faiss.IndexHNSWFlat(d, HNSW_M, faiss.METRIC_INNER_PRODUCT)
+
+
+def _configure_search_params(index: faiss.Index):
+    """Apply search-time parameters (nprobe / efSearch) to approximate indexes."""
+    if hasattr(index, "nprobe"):
+        index.nprobe = IVF_NPROBE
+    if hasattr(index, "hnsw"):
+        index.hnsw.efSearch = HNSW_EF_SEARCH
+
+
+def move_index_to_gpu(vectorstore: FAISS) -> bool:
+    """
+    Replace the vectorstore's index with a GPU copy, if possible.
+    
+    Large flat/IVF searches become GPU matrix products. Does nothing (and
+    returns False) with CPU-only FAISS builds, without a GPU, when disabled
+    via FAISS_USE_GPU, or for index types FAISS can't run on GPU (HNSW).
+    Call this after saving the index: GPU indexes can't be written as-is.
+    
+    Args:
+        vectorstore: FAISS vector store whose index is replaced in place
+        
+    Returns:
+        True if the index now lives on the GPU
+    """
+    global _gpu_resources
+    if not FAISS_USE_GPU or not hasattr(faiss, "StandardGpuResources") or faiss.get_num_gpus() == 0:
+        return False
+    try:
+        if _gpu_resources is None:
+            # Shared by every GPU index; must outlive them
+            _gpu_resources = faiss.StandardGpuResources()
+        gpu_index = faiss.index_cpu_to_gpu(_gpu_resources, FAISS_GPU_DEVICE, vectorstore.index)
+    except Exception as e:
+        logger.info("Keeping FAISS index on CPU (%s)", e)
+        return False
+    _configure_search_params(gpu_index)
+    vectorstore.index = gpu_index
+    logger.info("FAISS index moved to GPU %s", FAISS_GPU_DEVICE)
+    return True
+
+
+def save_faiss_index(vectorstore: FAISS, index_dir: str = "./faiss_index", vectors: Optional[np.ndarray] = None):
     """
     Save FAISS index to disk.
     
+    Besides LangChain's index.faiss/index.pkl, the documents are written to
+    docstore.jsonl so load_faiss_index() can read them lazily. index.pkl
+    still holds the full docstore so FAISS.load_local() can read the
+    directory.
+    
     Args:
         vectorstore: FAISS vector store to save
         index_dir: Directory to save the index
+        vectors: The exact vectors added to the index, shape (N, d); saved
+                 as embeddings.npy for reranking if the index is compressed
+                 (optional, ignored otherwise)
     """
     index_path = Path(index_dir)
     index_path.mkdir(parents=True, exist_ok=True)
-    vectorstore.save_local(str(index_path))
-    logger.info(f"FAISS index saved to {index_dir}")
+    # Same files as FAISS.save_local, but written to temp files and renamed
+    # into place: running workers may have the old index.faiss memory-mapped,
+    # and rewriting that inode in place would truncate their mappings (SIGBUS
+    # on the next search). A rename leaves them on the old inode.
+    tmp_index = index_path / "index.faiss.tmp"
+    faiss.write_index(vectorstore.index, str(tmp_index))
+    tmp_pkl = index_path / "index.pkl.tmp"
+    with open(tmp_pkl, "wb") as f:
+        pickle.dump((vectorstore.docstore, vectorstore.index_to_docstore_id), f)
+    tmp_index.replace(index_path / "index.faiss")
+    tmp_pkl.replace(index_path / "index.pkl")
+    save_docstore_jsonl(vectorstore.docstore, vectorstore.index_to_docstore_id, str(index_path))
+    if vectors is not None and index_is_compressed(vectorstore.index):
+        # Write then rename so a crash never leaves a half-written file
+        tmp_path = index_path / f"{EMBEDDINGS_FILE}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.save(f, np.ascontiguousarray(vectors, dtype="float32"))
+        tmp_path.replace(index_path / EMBEDDINGS_FILE)
+    else:
+        # Don't leave vectors from an earlier compressed index behind
+        (index_path / EMBEDDINGS_FILE).unlink(missing_ok=True)
+    logger.info("FAISS index saved to %s", index_dir)
+
+
+def extend_faiss_index(
+    embeddings: OpenAIEmbeddings,
+    index_dir: str,
+    texts: List[str],
+    metadatas: List[Dict],
+    vectors: np.ndarray,
+    threshold: float = DEDUP_THRESHOLD,
+) -> bool:
+    """
+    Append documents to a saved index instead of rebuilding it.
+    
+    New documents that are near-duplicates of each other or of an indexed
+    document are dropped, the rest are added to the index (row ids continue
+    after the existing ones) and the index, docstore and (for compressed
+    indexes) embeddings.npy are saved again. Every file is replaced by rename (see save_faiss_index), so
+    workers still serving the old memory-mapped index.faiss keep a valid
+    mapping until they reload. Trained indexes (sq8, IVF-PQ) keep their trained
+    quantizers, so callers should rebuild once the corpus has grown a lot.
+    
+    Args:
+        embeddings: Embeddings model
+        index_dir: Directory where the index is saved
+        texts: Page contents of the new documents
+        metadatas: Metadata of the new documents, same order
+        vectors: L2-normalized float32 embeddings of the texts, shape (M, d)
+        threshold: Cosine similarity at which two documents count as duplicates
+        
+    Returns:
+        True if the saved index now includes the new documents; False if it
+        can't be extended (missing, L2 metric, or a compressed index without
+        embeddings.npy)
+    """
+    vectorstore = load_faiss_index(embeddings, index_dir, mmap=False)
+    if vectorstore is None or vectorstore.distance_strategy != DistanceStrategy.MAX_INNER_PRODUCT:
+        return False
+    compressed = index_is_compressed(vectorstore.index)
+    if compressed:
+        existing = load_embeddings_matrix(index_dir, vectorstore.index.ntotal)
+    else:
+        # Loaded into RAM (not mmapped), so the exact vectors can be read back
+        existing = index_vectors(vectorstore)
+    if existing is None or existing.shape[1] != vectors.shape[1]:
+        return False
+    
+    keep = deduplicate_vectors(vectors, threshold)
+    if len(keep) and len(existing):
+        # Nearest indexed document of each new one (exact, over the saved vectors)
+        nearest, _ = faiss.knn(vectors[keep], np.ascontiguousarray(existing), 1, metric=faiss.METRIC_INNER_PRODUCT)
+        keep = [i for i, score in zip(keep, nearest[:, 0].tolist()) if score < threshold]
+    
+    # The lazy JSONL docstore is read-only; load it into memory to append
+    docstore = vectorstore.docstore
+    if isinstance(docstore, JsonlDocstore):
+        docstore = InMemoryDocstore(dict(zip(docstore.ids, docstore.iter_documents())))
+    
+    new_vectors = np.ascontiguousarray(vectors[keep], dtype="float32")
+    ids = [str(uuid.uuid4()) for _ in keep]
+    docstore.add({
+        doc_id: Document(page_content=texts[i], metadata=metadatas[i])
+        for doc_id, i in zip(ids, keep)
+    })
+    start = vectorstore.index.ntotal
+    vectorstore.index.add(new_vectors)
+    vectorstore.docstore = docstore
+    vectorstore.index_to_docstore_id.update(enumerate(ids, start))
+    
+    save_faiss_index(vectorstore, index_dir, vectors=np.concatenate([existing, new_vectors]) if compressed else None)
+    logger.info("Added %s documents to the saved index (%s total)", len(keep), vectorstore.index.ntotal)
+    return True
+
+
+def save_index_meta(meta: Dict, index_dir: str = "./faiss_index"):
+    """
+    Save index metadata (corpus fingerprint, embedding model, etc.) next to the index.
+    
+    Args:
+        meta: JSON-serializable metadata
+        index_dir: Directory where the index is saved
+    """
+    index_path = Path(index_dir)
+    index_path.mkdir(parents=True, exist_ok=True)
+    # Write then rename so a crash never leaves a half-written file
+    tmp_path = index_path / f"{INDEX_META_FILE}.tmp"
+    tmp_path.write_text(json.dumps(meta, indent=2, sort_keys=True))
+    tmp_path.replace(index_path / INDEX_META_FILE)
+
+
+def load_index_meta(index_dir: str = "./faiss_index") -> Optional[Dict]:
+    """
+    Load index metadata saved by save_index_meta().
+    
+    Args:
+        index_dir: Directory where the index is saved
+        
+    Returns:
+        Metadata dict, or None if missing or unreadable
+    """
+    try:
+        return json.loads((Path(index_dir) / INDEX_META_FILE).read_text())
+    except (OSError, ValueError):
+        return None
 
 
 def load_faiss_index(
     embeddings: OpenAIEmbeddings,
-    index_dir: str = "./faiss_index"
+    index_dir: str = "./faiss_index",
+    mmap: bool = True,
 ) -> Optional[FAISS]:
     """
     Load FAISS index from disk if it exists.
     
+    By default the index is memory-mapped read-only, so its pages are
+    loaded on demand and can be evicted under memory pressure instead
+    of being copied into process RAM. Documents are read lazily from
+    docstore.jsonl when present (indexes saved before it existed fall back
+    to unpickling the full docstore from index.pkl).
+    
     Args:
         embeddings: OpenAI embeddings model
         index_dir: Directory where the index is saved
+        mmap: Memory-map the index file instead of reading it into RAM
         
     Returns:
         FAISS vector store or None if not found
     """
     index_path = Path(index_dir)
     if not index_path.exists():
-        logger.info(f"No existing FAISS index found at {index_dir}")
+        logger.info("No existing FAISS index found at %s", index_dir)
         return None
     
     try:
-        vectorstore = FAISS.load_local(
-            str(index_path),
-            embeddings,
-            allow_dangerous_deserialization=True,
+        # Same files as FAISS.save_local/load_local, read without copying vectors
+        index = faiss.read_index(
+            str(index_path / "index.faiss"),
+            INDEX_MMAP_FLAGS if mmap else 0,
+        )
+        jsonl_path = index_path / DOCSTORE_FILE
+        if jsonl_path.exists():
+            docstore = JsonlDocstore(jsonl_path)
+            index_to_docstore_id = dict(enumerate(docstore.ids))
+        else:
+            with open(index_path / "index.pkl", "rb") as f:
+                docstore, index_to_docstore_id = pickle.load(f)
+        if len(index_to_docstore_id) != index.ntotal:
+            raise ValueError(f"docstore has {len(index_to_docstore_id)} documents, index has {index.ntotal} vectors")
+        
+        # The metric isn't persisted by LangChain; recover it from the raw index
+        if index.metric_type == faiss.METRIC_INNER_PRODUCT:
+            distance_strategy = DistanceStrategy.MAX_INNER_PRODUCT
+        else:
+            distance_strategy = DistanceStrategy.EUCLIDEAN_DISTANCE
+        _configure_search_params(index)
+        
+        vectorstore = FAISS(
+            embedding_function=embeddings,
+            index=index,
+            docstore=docstore,
+            index_to_docstore_id=index_to_docstore_id,
+            distance_strategy=distance_strategy,
         )
-        logger.info(f"FAISS index loaded from {index_dir}")
+        logger.info("FAISS index loaded from %s (mmap=%s)", index_dir, mmap)
         return vectorstore
     except Exception as e:
-        logger.error(f"Error loading FAISS index: {e}")
+        logger.error("Error loading FAISS index: %s", e)
         return None
 
 
@@ -261,53 +929,312 @@ def semantic_search(
     """
     Perform semantic search on the FAISS index.
     
+    Scores are always distances (lower is better). For inner-product
+    indexes the query embedding is L2-normalized once and the cosine
+    similarity is converted to a cosine distance.
+    
     Args:
         vectorstore: FAISS vector store
         query: Search query
         k: Number of top results to return
         
     Returns:
-        List of tuples (Document, similarity_score)
+        List of tuples (Document, distance_score)
+    """
+    logger.info("Performing semantic search for: '%s' (k=%s)", query, k)
+    if vectorstore.distance_strategy == DistanceStrategy.MAX_INNER_PRODUCT:
+        vector = embed_query_normalized(vectorstore.embedding_function, query)
+        results = semantic_search_by_vector(vectorstore, vector, k=k)
+    else:
+        # Indexes saved before the switch to inner product use L2 distance
+        results = vectorstore.similarity_search_with_score(query, k=k)
+    logger.info("Retrieved %s documents", len(results))
+    return results
+
+
+def embed_query_normalized(embeddings: OpenAIEmbeddings, query: str) -> np.ndarray:
+    """
+    Embed a query and L2-normalize it.
+    
+    Args:
+        embeddings: Embeddings model
+        query: Query text
+        
+    Returns:
+        Unit-length float32 vector, shape (d,)
+    """
+    vector = np.asarray(embeddings.embed_query(query), dtype="float32")
+    vector /= np.linalg.norm(vector) or 1.0
+    return vector
+
+
+def semantic_search_by_vector(
+    vectorstore: FAISS,
+    vector: np.ndarray,
+    k: int = 5
+) -> List[Tuple[Document, float]]:
+    """
+    Perform semantic search with an already-embedded, normalized query.
+    
+    Lets callers that need the query embedding anyway (e.g. for caching)
+    avoid a second embedding call. Scores follow semantic_search().
+    
+    Args:
+        vectorstore: FAISS vector store
+        vector: L2-normalized query embedding
+        k: Number of top results to return
+        
+    Returns:
+        List of tuples (Document, distance_score)
     """
-    logger.info(f"Performing semantic search for: '{query}' (k={k})")
-    results = vectorstore.similarity_search_with_score(query, k=k)
-    logger.info(f"Retrieved {len(results)} documents")
+    results = vectorstore.similarity_search_with_score_by_vector(vector, k=k)
+    if vectorstore.distance_strategy == DistanceStrategy.MAX_INNER_PRODUCT:
+        results = [(doc, 1.0 - score) for doc, score in results]
     return results
 
 
-def format_retrieved_context(top_docs: List[Tuple[Document, float]]) -> str:
+def embed_queries_normalized(embeddings: OpenAIEmbeddings, queries: List[str]) -> np.ndarray:
+    """
+    Embed several queries in one request and L2-normalize them.
+    
+    Args:
+        embeddings: Embeddings model
+        queries: Query texts
+        
+    Returns:
+        float32 array of shape (len(queries), d)
+    """
+    vectors = np.asarray(embeddings.embed_documents(queries), dtype="float32")
+    faiss.normalize_L2(vectors)
+    return vectors
+
+
+def batch_search_ids(
+    vectorstore: FAISS,
+    vectors: np.ndarray,
+    k: int = 5
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Search several normalized query vectors with a single FAISS call.
+    
+    One index.search over a (Q, d) matrix lets FAISS parallelize across
+    queries and use a matrix product instead of Q separate scans.
+    
+    Args:
+        vectorstore: FAISS vector store
+        vectors: L2-normalized query embeddings, shape (Q, d)
+        k: Number of results per query
+        
+    Returns:
+        Tuple of (distances, row ids), each shape (Q, k). Distances follow
+        semantic_search() (lower is better); missing results have id -1.
+    """
+    logger.info("Performing batched semantic search for %s queries (k=%s)", len(vectors), k)
+    scores, ids = vectorstore.index.search(np.ascontiguousarray(vectors, dtype="float32"), k)
+    if vectorstore.distance_strategy == DistanceStrategy.MAX_INNER_PRODUCT:
+        scores = 1.0 - scores
+    return scores, ids
+
+
+def load_embeddings_matrix(index_dir: str, expected_rows: int) -> Optional[np.ndarray]:
+    """
+    Memory-map the exact vectors saved by save_faiss_index(vectors=...)
+    for a compressed index.
+    
+    Args:
+        index_dir: Directory where the index is saved
+        expected_rows: Number of vectors in the index
+        
+    Returns:
+        Read-only float32 array of shape (N, d), or None if missing or
+        not matching the index
+    """
+    try:
+        matrix = np.load(Path(index_dir) / EMBEDDINGS_FILE, mmap_mode="r")
+    except (OSError, ValueError):
+        return None
+    if matrix.ndim != 2 or matrix.shape[0] != expected_rows or matrix.dtype != np.float32:
+        logger.warning("Ignoring %s: shape %s does not match the index (%s vectors)", EMBEDDINGS_FILE, matrix.shape, expected_rows)
+        return None
+    return matrix
+
+
+def index_is_compressed(index: faiss.Index) -> bool:
+    """True if the index doesn't store full float32 vectors (PQ / scalar quantizer)."""
+    return not isinstance(index, (faiss.IndexFlat, faiss.IndexHNSWFlat))
+
+
+def rerank_scores(matrix: np.ndarray, queries: np.ndarray, ids: np.ndarray) -> np.ndarray:
+    """
+    Exact distances for FAISS candidate ids, replacing approximate ones.
+    
+    Gathers each query's candidate vectors and scores them with one batched
+    matrix product (BLAS-backed), so compressed-index results can be
+    reordered by true cosine distance.
+    
+    Args:
+        matrix: Exact L2-normalized document vectors, shape (N, d)
+        queries: L2-normalized query vectors, shape (Q, d)
+        ids: Candidate row ids per query, shape (Q, C); -1 = no result
+        
+    Returns:
+        Cosine distances (1 - cos), shape (Q, C); inf where ids is -1
+    """
+    valid = ids != -1
+    candidates = matrix[np.where(valid, ids, 0).ravel()].reshape(ids.shape[0], ids.shape[1], -1)
+    scores = 1.0 - np.einsum("qcd,qd->qc", candidates, queries)
+    scores[~valid] = np.inf
+    return scores
+
+
+def index_vectors(vectorstore: FAISS) -> np.ndarray:
+    """
+    Read every stored vector back out of the FAISS index.
+    
+    Lets callers score an arbitrary subset of rows (e.g. one user's
+    documents) with a small matrix-vector product instead of a search.
+    Quantized indexes (fp16/sq8/ivfpq) return their decoded approximations.
+    
+    Args:
+        vectorstore: FAISS vector store
+        
+    Returns:
+        float32 array of shape (ntotal, d); row i is FAISS row id i
+    """
+    index = vectorstore.index
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        # IVF indexes need an id -> list map before rows can be reconstructed
+        ivf.make_direct_map()
+    return index.reconstruct_n(0, index.ntotal)
+
+
+def build_document_table(vectorstore: FAISS) -> pd.DataFrame:
+    """
+    Build a columnar table of lowercase user names indexed by FAISS row id.
+    
+    Name boosting groups rows by user name across the whole corpus, so that
+    one field is kept in memory as a column. Messages and timestamps are
+    only needed for the k retrieved rows and are read from the docstore
+    when the context is formatted (see format_context_from_docstore).
+    
+    Args:
+        vectorstore: FAISS vector store
+        
+    Returns:
+        DataFrame with a user_name_lower column; row i describes FAISS row
+        id i. Names come from each Document's metadata ("Unknown" if
+        missing).
+    """
+    docstore, index_to_id = vectorstore.docstore, vectorstore.index_to_docstore_id
+    if isinstance(docstore, JsonlDocstore):
+        # One sequential pass over the file, without filling the lookup cache
+        docs = docstore.iter_documents()
+    else:
+        docs = (docstore.search(index_to_id[i]) for i in range(len(index_to_id)))
+    # object dtype keeps the values exactly as stored (including None)
+    table = pd.DataFrame({
+        "user_name_lower": [doc.metadata.get("user_name", "Unknown") for doc in docs],
+    }, dtype=object)
+    table["user_name_lower"] = table["user_name_lower"].str.lower()
+    return table
+
+
+def smallest_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """
+    Positions of the k smallest scores, smallest first.
+    
+    numpy's counterpart to heapq.nsmallest: np.argpartition selects the k
+    smallest in linear time and only those k are sorted, instead of
+    sorting every candidate and discarding the tail.
+    
+    Args:
+        scores: 1-D array of scores (lower is better)
+        k: Number of positions to return
+        
+    Returns:
+        Integer index array of length min(k, len(scores))
+    """
+    if scores.size > k:
+        keep = np.argpartition(scores, k)[:k]
+        return keep[np.argsort(scores[keep], kind="stable")]
+    return np.argsort(scores, kind="stable")
+
+
+def best_unique_ids(ids: np.ndarray, scores: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Collapse repeated ids to their best (lowest) score and keep the top k.
+    
+    Vectorized replacement for merging per-query results through a dict:
+    ids are sorted once, np.minimum.reduceat takes each group's minimum,
+    and only the k best groups are kept.
+    
+    Args:
+        ids: FAISS row ids from one or more queries (-1 entries are ignored)
+        scores: Distance for each id (lower is better)
+        k: Number of results to keep
+        
+    Returns:
+        Tuple of (ids, scores) for up to k unique ids, best first
+    """
+    ids = np.asarray(ids).ravel()
+    scores = np.asarray(scores).ravel()
+    valid = ids != -1
+    ids, scores = ids[valid], scores[valid]
+    if ids.size == 0:
+        return ids, scores
+    
+    order = np.argsort(ids, kind="stable")
+    ids_sorted, scores_sorted = ids[order], scores[order]
+    starts = np.flatnonzero(np.r_[True, ids_sorted[1:] != ids_sorted[:-1]])
+    unique_ids = ids_sorted[starts]
+    best = np.minimum.reduceat(scores_sorted, starts)
+    
+    top = smallest_k(best, k)
+    return unique_ids[top], best[top]
+
+
+# Compact context entry: "[n] User Name (YYYY-MM-DD): message"; the date part
+# is omitted when a document has no timestamp. %-templates are parsed once
+# and fill the fields faster than str.format for these few short fields.
+_CONTEXT_ENTRY = "[%d] %s (%s): %s"
+_CONTEXT_ENTRY_NO_DATE = "[%d] %s: %s"
+
+
+def _format_context_entry(i: int, user_name, timestamp, message) -> str:
+    """Format one retrieved document's fields as a numbered context entry."""
+    # OPTIMIZED: Extract only date from timestamp (YYYY-MM-DD format)
+    # This provides date context for accuracy without excessive tokens
+    if timestamp:
+        return _CONTEXT_ENTRY % (i, user_name, str(timestamp)[:10], message)
+    return _CONTEXT_ENTRY_NO_DATE % (i, user_name, message)
+
+
+def format_context_from_docstore(vectorstore: FAISS, ids: np.ndarray) -> str:
     """
     Format retrieved documents into a context string for the LLM.
     
     OPTIMIZED FOR MEMORY: Compact formatting with essential timestamp info.
+    Only the k retrieved documents are looked up in the docstore (a lazy
+    JsonlDocstore reads just those lines); entries are produced by a
+    generator and joined once.
     
     Args:
-        top_docs: List of tuples (Document, similarity_score)
+        vectorstore: FAISS vector store the row ids belong to
+        ids: Row ids of the retrieved documents, best first
         
     Returns:
         Formatted context string
     """
-    context_parts = []
-    
-    for i, (doc, score) in enumerate(top_docs, 1):
-        user_name = doc.metadata.get("user_name", "Unknown")
-        message = doc.metadata.get("message", doc.page_content)
-        timestamp = doc.metadata.get("timestamp", "")
-        
-        # OPTIMIZED: Extract only date from timestamp (YYYY-MM-DD format)
-        # This provides date context for accuracy without excessive tokens
-        date_str = ""
-        if timestamp:
-            try:
-                # Extract just the date part (first 10 chars: YYYY-MM-DD)
-                date_str = f" ({timestamp[:10]})"
-            except:
-                pass
-        
-        # Compact format with optional date
-        context_parts.append(f"[{i}] {user_name}{date_str}: {message}")
-    
-    # OPTIMIZED: Use simpler separator to save memory
-    context = "\n\n".join(context_parts)
-    return context
+    docstore, index_to_id = vectorstore.docstore, vectorstore.index_to_docstore_id
+    docs = (docstore.search(index_to_id[row]) for row in ids.tolist())
+    return "\n\n".join(
+        _format_context_entry(
+            i,
+            doc.metadata.get("user_name", "Unknown"),
+            doc.metadata.get("timestamp"),
+            doc.metadata.get("message", doc.page_content),
+        )
+        for i, doc in enumerate(docs, 1)
+    )
 
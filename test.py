@@ -11,11 +11,15 @@ This script tests:
 
 import os
 import sys
+import asyncio
 
 # Fix OpenMP library conflict on macOS
 os.environ['KMP_DUPLICATE_LIB_OK'] = 'TRUE'
 
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from typing import Dict, Any, List
 from rich.console import Console
 from rich.panel import Panel
@@ -23,9 +27,9 @@ from rich.table import Table
 from rich.tree import Tree
 from rich.markdown import Markdown
 from rich import print as rprint
-from dotenv import load_dotenv
+from langgraph_agent.env import load_env
 
-load_dotenv()
+load_env()
 
 console = Console()
 
@@ -34,6 +38,14 @@ API_BASE_URL = "https://november7-730026606190.europe-west1.run.app"
 MESSAGES_ENDPOINT = f"{API_BASE_URL}/messages/"
 MESSAGES_API_KEY = os.getenv("MESSAGES_API_KEY")
 
+# Keep-alive session with retries on transient 5xx responses
+http_session = requests.Session()
+http_session.mount("https://", HTTPAdapter(
+    pool_maxsize=16,
+    max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=[502, 503, 504], raise_on_status=False),
+))
+http_session.headers["Accept-Encoding"] = "gzip"
+
 
 def print_header():
     """Print main header."""
@@ -67,7 +79,7 @@ def test_api_connectivity() -> bool:
         
         # Make request
         with console.status("[bold cyan]Fetching messages...", spinner="dots"):
-            response = requests.get(
+            response = http_session.get(
                 MESSAGES_ENDPOINT,
                 params={"skip": 0, "limit": 10},
                 headers=headers,
@@ -76,7 +88,7 @@ def test_api_connectivity() -> bool:
         
         # Check status
         if response.status_code == 200:
-            data = response.json()
+            data = orjson.loads(response.content)
             messages = data.get("items", [])
             total = data.get("total", 0)
             
@@ -198,7 +210,18 @@ def test_rag_queries(agent: Any) -> bool:
     
     success_count = 0
     
-    for i, (query_type, question) in enumerate(test_questions, 1):
+    # Retrieve context for every question in one batch (one embeddings
+    # request), then generate the answers concurrently; panels are printed
+    # in question order once all answers are in. A failed question comes
+    # back as its exception, so only its own panel shows the error
+    try:
+        with console.status(f"[bold cyan]Processing {len(test_questions)} questions...", spinner="dots"):
+            answers = asyncio.run(agent.aask_many([question for _, question in test_questions]))
+    except Exception as e:
+        # Batched retrieval failed: no question got an answer
+        answers = [e] * len(test_questions)
+    
+    for i, ((query_type, question), answer) in enumerate(zip(test_questions, answers), 1):
         # Print question
         console.print(
             Panel(
@@ -210,32 +233,28 @@ def test_rag_queries(agent: Any) -> bool:
             )
         )
         
-        # Get answer
-        try:
-            with console.status("[bold cyan]Processing...", spinner="dots"):
-                answer = agent.ask(question)
-            
-            # Print answer
-            console.print(
-                Panel(
-                    Markdown(answer),
-                    title=f"[bold green]Answer[/bold green]",
-                    border_style="green",
-                    padding=(1, 2)
-                )
-            )
-            console.print()
-            
-            success_count += 1
-            
-        except Exception as e:
+        if isinstance(answer, BaseException):
             console.print(
                 Panel(
-                    f"[bold red]Error:[/bold red] {str(e)}",
+                    f"[bold red]Error:[/bold red] {str(answer)}",
                     border_style="red"
                 )
             )
             console.print()
+            continue
+        
+        # Print answer
+        console.print(
+            Panel(
+                Markdown(answer),
+                title=f"[bold green]Answer[/bold green]",
+                border_style="green",
+                padding=(1, 2)
+            )
+        )
+        console.print()
+        
+        success_count += 1
     
     # Summary
     if success_count == len(test_questions):